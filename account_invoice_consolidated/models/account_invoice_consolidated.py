@@ -11,40 +11,55 @@ class AccountInvoiceConsolidation(models.Model):
     _inherit = ["mail.thread", "mail.activity.mixin"]
     _description = "Invoice Consolidation"
 
-    @api.depends("invoice_ids", "invoice_id", "payment_ids")
-    def compute_amount(self):
-        amount_untaxed = 0.0
-        amount_tax = 0.0
-        residual = 0.0
-        for consolidated_inv in self.sudo():
-            invoice_ids = (
-                consolidated_inv.invoice_ids.sudo()
-                .search([("consolidated_by_id", "=", consolidated_inv.id)])
-                .ids
+    @api.depends(
+        "invoice_ids.amount_untaxed",
+        "invoice_ids.amount_tax",
+        "invoice_ids.amount_residual",
+    )
+    def _compute_amount(self):
+        """Sum the amounts of the invoices of all the consolidations with one
+        grouped query. Depending on the residual of the invoices, the amounts
+        follow the payments of the invoices.
+        """
+        totals = {}
+        if self._origin.ids:
+            self.env["account.move"].flush(
+                [
+                    "consolidated_by_id",
+                    "amount_untaxed",
+                    "amount_tax",
+                    "amount_residual",
+                ]
+            )
+            self.env.cr.execute(
+                """
+                SELECT
+                    consolidated_by_id,
+                    sum(amount_untaxed) as amount_untaxed,
+                    sum(amount_tax) as amount_tax,
+                    sum(amount_residual) as amount_residual
+                FROM
+                    account_move
+                WHERE
+                    consolidated_by_id in %s
+                GROUP BY
+                    consolidated_by_id
+            """,
+                (tuple(self._origin.ids),),
+            )
+            totals = {row[0]: row[1:] for row in self.env.cr.fetchall()}
+        for consolidated_inv in self:
+            amount_untaxed, amount_tax, residual = totals.get(
+                consolidated_inv._origin.id, (0.0, 0.0, 0.0)
             )
-            if invoice_ids:
-                self.env.cr.execute(
-                    """
-                    SELECT
-                        sum(amount_untaxed) as amount_untaxed,
-                        sum(amount_tax) as amount_tax,
-                        sum(amount_residual) as amount_residual
-                    FROM
-                        account_move
-                    WHERE
-                        id in %s
-                """,
-                    (tuple(invoice_ids),),
-                )
-                vals = self.env.cr.dictfetchall()
-                amount_untaxed += vals[0]["amount_untaxed"]
-                amount_tax += vals[0]["amount_tax"]
-                residual += vals[0]["amount_residual"]
             consolidated_inv.amount_untaxed = amount_untaxed
             consolidated_inv.amount_tax = amount_tax
             consolidated_inv.residual = residual
             consolidated_inv.amount_total = amount_untaxed + amount_tax
 
+    def compute_amount(self):
+        self._compute_amount()
+
     name = fields.Char(readonly=True, default="Draft")
     date_from = fields.Date(
         required=True, readonly=True, states={"draft": [("readonly", False)]}
@@ -151,48 +166,69 @@ class AccountInvoiceConsolidation(models.Model):
         ):
             self.invoice_ids = False
         if self.date_from and self.date_to and self.partner_id:
-            inv_rec = (
-                self.env["account.move"]
-                .sudo()
-                .search(
-                    [
-                        ("partner_id", "=", self.partner_id.id),
-                        ("invoice_date", ">=", self.date_from),
-                        ("invoice_date", "<=", self.date_to),
-                        ("state", "=", "posted"),
-                        ("payment_state", "!=", "paid"),
-                        ("move_type", "=", "out_invoice"),
-                    ]
-                )
-            )
-            if inv_rec:
-                for inv in inv_rec:
-                    query = """UPDATE
-                                    account_move SET
-                                    consolidated_by_id = %s
-                                WHERE id=%s
-                            """
-                    self.env.cr.execute(query, [self.id, inv.id])
-                    for _inv_line in inv:
-                        query = """UPDATE account_move_line \
-                        SET consolidated_by_id = %s WHERE id=%s"""
-                        self.env.cr.execute(query, [self.id, inv.id])
-            self.sudo().invoice_ids = (
-                self.env["account.move"]
-                .sudo()
-                .search([("consolidated_by_id", "=", self.id)])
-                .ids
-            )
-            self.sudo().invoice_line_ids = (
-                self.env["account.move.line"]
-                .sudo()
-                .search([("consolidated_by_id", "=", self.id)])
-                .ids
+            self._collect_invoices(
+                [
+                    ("partner_id", "=", self.partner_id.id),
+                    ("invoice_date", ">=", self.date_from),
+                    ("invoice_date", "<=", self.date_to),
+                    ("state", "=", "posted"),
+                    ("payment_state", "!=", "paid"),
+                    ("move_type", "=", "out_invoice"),
+                ]
             )
 
+    def _collect_invoices(self, domain):
+        """Link the invoices matching `domain` and their lines to this
+        consolidation, with one UPDATE on the invoices and one on their lines.
+        """
+        self.ensure_one()
+        move_obj = self.env["account.move"].sudo()
+        line_obj = self.env["account.move.line"].sudo()
+        # The UPDATEs read the database, write the pending changes first
+        move_obj.flush([fname for fname, _op, _value in domain])
+        move_obj.flush(["consolidated_by_id"])
+        line_obj.flush(["move_id", "consolidated_by_id"])
+        query = move_obj._where_calc(domain)
+        from_clause, where_clause, where_params = query.get_sql()
+        # The invoices may be taken from another consolidation, returned for
+        # updating it too
+        self.env.cr.execute(
+            """
+            UPDATE account_move m SET consolidated_by_id = %s
+            FROM (
+                SELECT "account_move".id, "account_move".consolidated_by_id
+                FROM {} WHERE {}
+            ) old
+            WHERE m.id = old.id
+            RETURNING m.id, old.consolidated_by_id
+            """.format(
+                from_clause, where_clause
+            ),
+            [self.id] + where_params,
+        )
+        rows = self.env.cr.fetchall()
+        move_ids = [row[0] for row in rows]
+        consolidations = self | self.browse([row[1] for row in rows if row[1]])
+        self.env.cr.execute(
+            """
+            UPDATE account_move_line l SET consolidated_by_id = m.consolidated_by_id
+            FROM account_move m
+            WHERE l.move_id = m.id AND m.consolidated_by_id = %s
+                AND l.consolidated_by_id IS DISTINCT FROM m.consolidated_by_id
+            RETURNING l.id
+            """,
+            [self.id],
+        )
+        line_ids = [row[0] for row in self.env.cr.fetchall()]
+        move_obj.invalidate_cache(["consolidated_by_id"], move_ids)
+        line_obj.invalidate_cache(["consolidated_by_id"], line_ids)
+        consolidations.invalidate_cache(
+            ["invoice_ids", "invoice_line_ids"], consolidations.ids
+        )
+        consolidations.modified(["invoice_ids"])
+
     def get_invoice_price(self):
         self.get_invoices()
-        self.compute_amount()
         if self.state != "invoice":
             self.state = "invoice"
 
@@ -251,7 +287,6 @@ class AccountInvoiceConsolidation(models.Model):
             )
             if invoice_id.invoice_line_ids:
                 invoice_id.action_post()
-            rec.compute_amount()
             rec.write({"invoice_id": invoice_id.id, "state": "done"})
 
     def unlink(self):
@@ -143,6 +143,11 @@ class TestConsolidatedInvoice(SavepointCase):
         inv.sudo().get_invoices()
         self.assertIn(self.invoice_obj_a.id, inv.invoice_ids.ids)
         self.assertIn(self.invoice_obj_b.id, inv.invoice_ids.ids)
+        self.assertEqual(
+            inv.invoice_line_ids,
+            (self.invoice_obj_a | self.invoice_obj_b).line_ids,
+        )
+        self.assertEqual(self.invoice_obj_a.consolidated_by_id, inv)
 
         # Calculate the total price
         inv.sudo().get_invoice_price()
@@ -155,6 +160,7 @@ class TestConsolidatedInvoice(SavepointCase):
         inv.sudo().action_confirm_invoice()
         self.assertEqual(self.invoice_obj_a.payment_state, "paid")
         self.assertEqual(self.invoice_obj_b.payment_state, "paid")
+        self.assertEqual(inv.residual, 0.0)
 
         with self.assertRaises(ValidationError):
             inv.write({"name": "Test"})
@@ -207,11 +213,52 @@ class TestConsolidatedInvoice(SavepointCase):
         # Calculate the total price
         inv.sudo().get_invoice_price()
 
+        # Computed together, the totals of the consolidations don't mix
+        other_inv = self.consolidated_inv_obj.create(
+            {
+                "company_id": self.company_a.id,
+                "date_from": datetime.today() + relativedelta(months=-6),
+                "date_to": datetime.today(),
+                "partner_id": self.company_b.partner_id.id,
+            }
+        )
+        (inv | other_inv).compute_amount()
+        self.assertEqual(
+            inv.amount_total,
+            self.invoice_obj_a.amount_total + self.invoice_obj_b.amount_total,
+        )
+        self.assertEqual(other_inv.amount_total, 0.0)
+
         with self.assertRaises(ValidationError):
             inv.update({"invoice_ids": []})
             # Confirm the invoice and verify both invoices have been paid
             inv.sudo().action_confirm_invoice()
 
+    def test_consolidated_invoice_moved(self):
+        vals = {
+            "company_id": self.company_a.id,
+            "date_from": datetime.today() + relativedelta(months=-6),
+            "date_to": datetime.today(),
+            "partner_id": self.partner_user.id,
+        }
+        inv = self.consolidated_inv_obj.create(vals)
+        inv.sudo().get_invoice_price()
+        self.assertEqual(
+            inv.amount_total,
+            self.invoice_obj_a.amount_total + self.invoice_obj_b.amount_total,
+        )
+        # Invoices collected by another consolidation are removed from this one
+        other_inv = self.consolidated_inv_obj.create(vals)
+        other_inv.sudo().get_invoices()
+        self.assertEqual(other_inv.invoice_ids, self.invoice_obj_a | self.invoice_obj_b)
+        self.assertFalse(inv.invoice_ids)
+        self.assertFalse(inv.invoice_line_ids)
+        self.assertEqual(inv.amount_total, 0.0)
+        self.assertEqual(
+            other_inv.amount_total,
+            self.invoice_obj_a.amount_total + self.invoice_obj_b.amount_total,
+        )
+
     def test_consolidated_tax(self):
         inv = self.consolidated_inv_obj.create(
             {
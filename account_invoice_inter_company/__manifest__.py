@@ -12,7 +12,13 @@
     "website": "https://github.com/OCA/multi-company",
     "author": "Odoo SA, Akretion, Odoo Community Association (OCA)",
     "license": "AGPL-3",
-    "depends": ["account"],
-    "data": ["views/account_move_views.xml", "views/res_config_settings_view.xml"],
+    "depends": ["account", "res_company_partner_index"],
+    "data": [
+        "security/ir.model.access.csv",
+        "data/ir_cron.xml",
+        "views/account_invoice_inter_company_stat_views.xml",
+        "views/account_move_views.xml",
+        "views/res_config_settings_view.xml",
+    ],
     "installable": True,
 }
@@ -2,6 +2,8 @@
 # Copyright 2015-2017 Chafique Delli <chafique.delli@akretion.com>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+from . import account_invoice_inter_company_stat
 from . import account_move
+from . import ir_attachment
 from . import res_config_settings
 from . import res_company
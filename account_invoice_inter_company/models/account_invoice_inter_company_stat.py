@@ -0,0 +1,43 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import fields, models
+
+
+class AccountInvoiceInterCompanyStat(models.Model):
+    """Wall time and SQL queries spent in a stage of the creation of inter
+    company invoices, stored when the instrumentation is set to ``store``.
+    """
+
+    _name = "account.invoice.inter.company.stat"
+    _description = "Inter Company Invoice Stage Statistics"
+    _order = "date desc, id desc"
+    _log_access = False
+
+    date = fields.Datetime(
+        required=True, readonly=True, index=True, default=fields.Datetime.now
+    )
+    stage = fields.Selection(
+        selection=[
+            ("partner_resolution", "Partner Resolution"),
+            ("product_check", "Product Check"),
+            ("invoice_data", "Invoice Data"),
+            ("line_data", "Line Data"),
+            ("create", "Creation"),
+            ("autocomplete", "Lines Autocompletion"),
+            ("resync", "Draft Counterparts Synchronisation"),
+            ("post", "Posting"),
+            ("pdf_attachment", "PDF Attachment"),
+        ],
+        required=True,
+        readonly=True,
+    )
+    dest_company_id = fields.Many2one(
+        comodel_name="res.company",
+        string="Destination Company",
+        readonly=True,
+        index=True,
+        ondelete="cascade",
+    )
+    invoice_count = fields.Integer(string="Invoices", readonly=True)
+    duration = fields.Float(string="Duration (ms)", readonly=True)
+    query_count = fields.Integer(string="SQL Queries", readonly=True)
@@ -1,13 +1,36 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
 import base64
+import hashlib
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
 
-from odoo import _, api, fields, models
-from odoo.exceptions import AccessError, UserError
+from psycopg2 import OperationalError
+
+from odoo import SUPERUSER_ID, _, api, fields, models, registry
+from odoo.exceptions import UserError
 from odoo.tests.common import Form
-from odoo.tools import float_compare
+from odoo.tools import float_compare, split_every
 from odoo.tools.misc import clean_context
 
+_logger = logging.getLogger(__name__)
+_stats_logger = logging.getLogger(__name__ + ".stats")
+
+
+def _get_changed_values(record, vals):
+    """Return the items of `vals` that would change the values of `record`"""
+    changed = {}
+    for fname, value in vals.items():
+        field = record._fields[fname]
+        new_value = field.convert_to_record(
+            field.convert_to_cache(value, record), record
+        )
+        if new_value != record[fname]:
+            changed[fname] = value
+    return changed
+
 
 class AccountMove(models.Model):
 
@@ -25,8 +48,7 @@ class AccountMove(models.Model):
     )
     related_bill_id = fields.Many2one(
         "account.move",
-        compute="_compute_related_bill_info",
-        compute_sudo=False,
+        compute="_compute_related_bill",
     )
     related_bill_ids = fields.One2many(
         "account.move",
@@ -36,177 +58,700 @@ class AccountMove(models.Model):
         copy=False,
     )
     related_bill_name = fields.Char(
-        compute="_compute_related_bill_info",
+        compute="_compute_related_bill",
     )
     related_bill_company_id = fields.Many2one(
         "res.company",
-        compute="_compute_related_bill_info",
+        compute="_compute_related_bill",
+    )
+    intercompany_dest_company_id = fields.Many2one(
+        "res.company",
+        string="Inter Company Destination",
+        copy=False,
+        readonly=True,
+        index=True,
+        help="Company of the partner of this invoice, where its counterpart "
+        "is created, resolved when posting.",
+    )
+    intercompany_pdf_pending = fields.Boolean(
+        string="Inter Company PDF Pending",
+        copy=False,
+        readonly=True,
+        index=True,
+        help="The PDF of this invoice has still to be attached to its "
+        "inter company counterpart.",
     )
 
-    def _compute_related_bill_info(self):
+    def _get_related_bills(self):
+        """Return the first related bill of each of these moves, fetched with
+        a single query.
+
+        :return: dict {move id: related bill, as superuser}
+        """
+        related_bills = {}
+        bills = self.sudo().search([("auto_invoice_id", "in", self._origin.ids)])
+        for bill in bills:
+            related_bills.setdefault(bill.auto_invoice_id.id, bill)
+        return related_bills
+
+    def _compute_related_bill_values(self, fnames):
+        """Assign the given related bill fields of these moves, from a single
+        search of their related bills.
+
+        :param fnames: names among related_bill_id, related_bill_name and
+            related_bill_company_id
+        """
+        related_bills = self._get_related_bills()
+        bills = self.sudo().browse([bill.id for bill in related_bills.values()])
+        names = dict(bills.name_get()) if "related_bill_name" in fnames else {}
+        company_ids = self.env.companies.ids
         for rec in self:
-            rec.related_bill_name = rec.sudo().related_bill_ids[:1].display_name
-            rec.related_bill_company_id = rec.sudo().related_bill_ids[:1].company_id.id
-            if rec.related_bill_company_id.id not in self.env.companies.ids:
-                rec.related_bill_id = False
-            else:
-                rec.related_bill_id = rec.related_bill_ids[:1].id
+            bill = related_bills.get(rec._origin.id, bills.browse())
+            values = {
+                "related_bill_id": bill.company_id.id in company_ids and bill.id,
+                "related_bill_name": names.get(bill.id, False),
+                "related_bill_company_id": bill.company_id.id,
+            }
+            for fname in fnames:
+                rec[fname] = values[fname]
+
+    @api.depends_context("allowed_company_ids")
+    def _compute_related_bill(self):
+        self._compute_related_bill_values(
+            ["related_bill_id", "related_bill_name", "related_bill_company_id"]
+        )
 
     def _find_company_from_invoice_partner(self):
         self.ensure_one()
-        company = (
+        if self.state == "posted" and self.intercompany_dest_company_id:
+            return (
+                self.env["res.company"]
+                .sudo()
+                .browse(self.intercompany_dest_company_id.id)
+            )
+        return self._resolve_intercompany_dest_company() or False
+
+    def _resolve_intercompany_dest_company(self):
+        """Look up the company of the partner of this invoice, ignoring the one
+        stored when posting.
+        """
+        self.ensure_one()
+        return (
             self.env["res.company"]
             .sudo()
-            .search(
-                [
-                    ("partner_id", "=", self.commercial_partner_id.id),
-                    ("id", "!=", self.company_id.id),
-                ],
-                limit=1,
+            ._find_company_from_partner(
+                self.commercial_partner_id, exclude_company=self.company_id
             )
         )
-        return company or False
+
+    def _store_intercompany_dest_company(self):
+        """Store the destination company of these invoices, with one write per
+        company for the invoices whose company changed.
+        """
+        move_ids_by_company = defaultdict(list)
+        for move in self.filtered(lambda x: x.is_invoice()):
+            company = move._resolve_intercompany_dest_company()
+            if move.intercompany_dest_company_id.id != company.id:
+                move_ids_by_company[company.id].append(move.id)
+        for company_id, move_ids in move_ids_by_company.items():
+            self.browse(move_ids).write({"intercompany_dest_company_id": company_id})
+
+    @api.model
+    def _recompute_intercompany_dest_company(self, companies):
+        """Resolve again the destination company of the posted invoices related
+        to `companies`, e.g. after a change of their partner.
+        """
+        moves = self.sudo().search(
+            [
+                ("state", "=", "posted"),
+                "|",
+                ("intercompany_dest_company_id", "in", companies.ids),
+                ("commercial_partner_id", "in", companies.partner_id.ids),
+            ]
+        )
+        moves._store_intercompany_dest_company()
 
     def _post(self, soft=True):
         """Validated invoice generate cross invoice base on company rules"""
         res = super()._post(soft=soft)
+        self.filtered(lambda x: x.state == "posted")._store_intercompany_dest_company()
         if not self.env.context.get("account_invoice_inter_company_queued"):
             self.create_counterpart_invoices()
         return res
 
     def create_counterpart_invoices(self):
+        self._create_counterpart_invoices(isolated=False)
+
+    def _create_counterpart_invoices(self, isolated=True):
+        """Create the counterpart invoices of these invoices, in one batch per
+        destination company and intercompany user. The PDFs are attached once
+        all the counterparts are created.
+
+        :param isolated: whether the counterpart of an invoice failing to be
+            created doesn't prevent the creation of the other ones. Otherwise,
+            the first failure is raised.
+        :return: dict mapping the ids of the source invoices whose counterpart
+            couldn't be created to the raised exception
+        """
         # Intercompany account entries or receipts aren't supported
         supported_types = {"out_invoice", "in_invoice", "out_refund", "in_refund"}
-        for src_invoice in self.filtered(lambda x: x.move_type in supported_types):
+        groups = defaultdict(list)
+        with self._intercompany_stage("partner_resolution"):
+            for src_invoice in self.filtered(lambda x: x.move_type in supported_types):
+                dest_company = src_invoice._find_company_from_invoice_partner()
+                if dest_company:
+                    groups[dest_company].append(src_invoice.id)
+        failed = {}
+        to_attach_by_company = []
+        for dest_company, src_invoice_ids in groups.items():
+            intercompany_user = dest_company.intercompany_invoice_user_id
+            src_invoices = self.browse(src_invoice_ids)
+            if intercompany_user:
+                src_invoices = src_invoices.with_user(intercompany_user).sudo()
+            else:
+                src_invoices = src_invoices.sudo()
             # do not consider invoices that have already been auto-generated,
             # nor the invoices that were already validated in the past
-            dest_company = src_invoice._find_company_from_invoice_partner()
-            if dest_company:
-                intercompany_user = dest_company.intercompany_invoice_user_id
-                if intercompany_user:
-                    src_invoice = src_invoice.with_user(intercompany_user).sudo()
+            to_create = src_invoices.filtered(lambda x: not x.auto_generated)
+            if to_create:
+                to_create = to_create.with_company(dest_company.id).with_context(
+                    skip_check_amount_difference=True
+                )
+                if isolated:
+                    failed.update(
+                        to_create._inter_company_create_invoices_isolated(dest_company)
+                    )
+                elif to_create._inter_company_create_invoice_overridden():
+                    for src_invoice in to_create:
+                        src_invoice._inter_company_create_invoice(dest_company)
                 else:
-                    src_invoice = src_invoice.sudo()
-                if not src_invoice.auto_generated:
-                    src_invoice.with_company(dest_company.id).with_context(
-                        skip_check_amount_difference=True
-                    )._inter_company_create_invoice(dest_company)
-                if src_invoice.move_type in ["out_invoice", "out_refund"]:
-                    src_invoice._attach_original_pdf_report()
+                    to_create._inter_company_create_invoices(dest_company)
+            to_attach_by_company.append((dest_company, src_invoices))
+        for dest_company, src_invoices in to_attach_by_company:
+            to_attach = src_invoices.filtered(
+                lambda x: x.id not in failed
+                and x.move_type in ["out_invoice", "out_refund"]
+            )
+            with to_attach._intercompany_stage("pdf_attachment", dest_company):
+                to_attach._attach_original_pdf_report()
+        self._store_intercompany_stats()
+        return failed
+
+    def _inter_company_create_invoices_isolated(self, dest_company):
+        """Create the invoices of `dest_company` for these invoices in a single
+        batch. If the batch fails, fall back to one invoice at a time, each in
+        its own savepoint, so that only the faulty invoices are left aside.
+
+        :return: dict mapping the ids of the failed source invoices to the
+            raised exception
+        """
+        per_invoice = self._inter_company_create_invoice_overridden()
+        if len(self) > 1 and not per_invoice:
+            try:
+                with self.env.cr.savepoint():
+                    self._inter_company_create_invoices(dest_company)
+                return {}
+            except Exception as e:
+                if self._is_intercompany_retryable_error(e):
+                    raise
+        failed = {}
+        for src_invoice in self:
+            try:
+                with self.env.cr.savepoint():
+                    if per_invoice:
+                        src_invoice._inter_company_create_invoice(dest_company)
+                    else:
+                        src_invoice._inter_company_create_invoices(dest_company)
+            except Exception as e:
+                if self._is_intercompany_retryable_error(e):
+                    raise
+                failed[src_invoice.id] = e
+        return failed
+
+    def _is_intercompany_retryable_error(self, error):
+        """Whether `error` is due to the transaction, e.g. a concurrent update
+        or a lock, rather than to the invoices, in which case the whole
+        transaction is to be retried instead of the invoices being left aside.
+        """
+        return isinstance(error, OperationalError)
+
+    def _inter_company_create_invoice_overridden(self):
+        """Whether an installed module overrides `_inter_company_create_invoice`,
+        the former per invoice extension point, in which case the invoices are
+        created one at a time through it for keeping its logic.
+        """
+        return (
+            type(self)._inter_company_create_invoice
+            is not AccountMove._inter_company_create_invoice
+        )
 
     def _attach_original_pdf_report(self):
-        supplier_invoice = self.auto_invoice_id
-        if not supplier_invoice:
-            supplier_invoice = self.search([("auto_invoice_id", "=", self.id)], limit=1)
-        pdf = (
-            self.env.ref("account.account_invoices")
-            .with_company(self.company_id)
-            ._render_qweb_pdf([self.id])[0]
+        to_defer = self.filtered("company_id.intercompany_invoice_defer_pdf")
+        if to_defer:
+            to_defer._defer_original_pdf_report()
+        (self - to_defer)._attach_original_pdf_reports()
+
+    def _defer_original_pdf_report(self):
+        """Flag these invoices for having their PDF attached to their
+        counterparts once the current transaction is committed. The invoices
+        left pending are retried by a scheduled action.
+        """
+        self.write({"intercompany_pdf_pending": True})
+        cr = self.env.cr
+        pending_ids = cr.cache.setdefault(
+            "account_invoice_inter_company_pending_pdf", set()
         )
-        self.env["ir.attachment"].create(
-            {
-                "name": self.name + ".pdf",
-                "type": "binary",
-                "datas": base64.b64encode(pdf),
-                "res_model": "account.move",
-                "res_id": supplier_invoice.id,
-                "mimetype": "application/pdf",
-            }
+        if not pending_ids:
+            dbname = cr.dbname
+
+            def render_pending_pdf_reports():
+                invoice_ids = list(pending_ids)
+                pending_ids.clear()
+                try:
+                    with registry(dbname).cursor() as new_cr:
+                        env = api.Environment(new_cr, SUPERUSER_ID, {})
+                        env["account.move"].browse(
+                            invoice_ids
+                        )._render_pending_pdf_reports()
+                except Exception:
+                    _logger.exception(
+                        "Attaching the PDF of the invoices %s failed, they are "
+                        "left pending",
+                        invoice_ids,
+                    )
+
+            cr.postcommit.add(render_pending_pdf_reports)
+            cr.postrollback.add(pending_ids.clear)
+        pending_ids.update(self.ids)
+
+    @api.model
+    def _cron_render_pending_pdf_reports(self):
+        self.search(
+            [("intercompany_pdf_pending", "=", True)]
+        )._render_pending_pdf_reports()
+
+    def _render_pending_pdf_reports(self):
+        """Attach the PDF of the pending invoices to their counterparts, in
+        batches of invoices of the same company. A failing batch is left
+        pending for a later retry.
+        """
+        batch_size = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("account_invoice_inter_company.pdf_batch_size", 50)
         )
+        pending = self.filtered("intercompany_pdf_pending")
+        for company in pending.company_id:
+            invoices = pending.filtered(lambda x: x.company_id == company)
+            for batch in split_every(batch_size, invoices.ids, self.browse):
+                try:
+                    with self.env.cr.savepoint():
+                        batch._attach_original_pdf_reports()
+                except Exception:
+                    _logger.exception(
+                        "Attaching the PDF of the invoices %s failed, they are "
+                        "left pending",
+                        batch.ids,
+                    )
 
-    def _check_intercompany_product(self, dest_company):
+    def _get_original_pdf_signature(self):
+        """Return a digest of the HTML rendering of this invoice, stored on the
+        attachment of its PDF for not converting an unchanged invoice to PDF
+        again.
+        """
         self.ensure_one()
-        if dest_company.company_share_product:
+        report = self.env.ref("account.account_invoices").with_company(self.company_id)
+        html = report._render_qweb_html([self.id])[0]
+        if isinstance(html, str):
+            html = html.encode()
+        return hashlib.sha1(html).hexdigest()
+
+    def _attach_original_pdf_reports(self):
+        """Attach the PDF of these invoices to their counterparts, unless the
+        counterpart already has a copy rendered from the same invoice content.
+        """
+        if not self:
             return
-        domain = dest_company._get_user_domain()
-        dest_user = self.env["res.users"].search(domain, limit=1)
-        for line in self.invoice_line_ids:
-            try:
-                line.product_id.product_tmpl_id.sudo(False).with_user(
-                    dest_user
-                ).with_context(
-                    {"allowed_company_ids": [dest_company.id]}
-                ).check_access_rule(
-                    "read"
+        counterparts = self.search([("auto_invoice_id", "in", self.ids)])
+        attachments = self.env["ir.attachment"].search(
+            [
+                ("res_model", "=", "account.move"),
+                ("res_id", "in", (counterparts | self.auto_invoice_id).ids),
+            ]
+        )
+        targets = {}
+        signatures = {}
+        for invoice in self:
+            supplier_invoice = (
+                invoice.auto_invoice_id
+                or counterparts.filtered(lambda x: x.auto_invoice_id == invoice)[:1]
+            )
+            name = invoice.name + ".pdf"
+            signatures[invoice.id] = invoice._get_original_pdf_signature()
+            if not any(
+                attachment.res_id == supplier_invoice.id
+                and attachment.name == name
+                and attachment.intercompany_pdf_signature == signatures[invoice.id]
+                for attachment in attachments
+            ):
+                targets[invoice] = supplier_invoice
+        if targets:
+            to_render = self.browse([invoice.id for invoice in targets])
+            pdfs = {}
+            for company in to_render.company_id:
+                pdfs.update(
+                    to_render.filtered(
+                        lambda x: x.company_id == company
+                    )._render_original_pdf_reports()
                 )
-            except AccessError:
-                raise UserError(
-                    _(
-                        "You cannot create invoice in company '%s' with "
-                        "product '%s' because it is not multicompany"
-                    )
-                    % (dest_company.name, line.product_id.name)
+            self.env["ir.attachment"].create(
+                [
+                    {
+                        "name": invoice.name + ".pdf",
+                        "type": "binary",
+                        "datas": base64.b64encode(pdfs[invoice.id]),
+                        "res_model": "account.move",
+                        "res_id": supplier_invoice.id,
+                        "mimetype": "application/pdf",
+                        "intercompany_pdf_signature": signatures[invoice.id],
+                    }
+                    for invoice, supplier_invoice in targets.items()
+                ]
+            )
+        self.filtered("intercompany_pdf_pending").write(
+            {"intercompany_pdf_pending": False}
+        )
+
+    def _render_original_pdf_reports(self):
+        """Render the PDF of these invoices of a same company.
+
+        When the report saves its documents as attachments, all the invoices
+        are rendered with a single wkhtmltopdf call, the report splitting the
+        result per invoice. Otherwise they are rendered one by one.
+
+        :return: dict {invoice id: PDF content}
+        """
+        report = self.env.ref("account.account_invoices").with_company(
+            self.company_id[:1]
+        )
+        reuse_attachments = report.attachment and (
+            len(self) > 1 or report.attachment_use
+        )
+        if len(self) > 1 and reuse_attachments:
+            report._render_qweb_pdf(self.ids)
+        pdfs = {}
+        for invoice in self:
+            attachment = reuse_attachments and report.retrieve_attachment(invoice)
+            if attachment:
+                pdfs[invoice.id] = attachment.raw
+            else:
+                pdfs[invoice.id] = report._render_qweb_pdf([invoice.id])[0]
+        return pdfs
+
+    def _check_intercompany_product(self, dest_company):
+        """Check the products of these invoices can be read in `dest_company`,
+        evaluating the product rules once for all of them.
+        """
+        if dest_company.company_share_product:
+            return
+        dest_user = dest_company._get_intercompany_check_user()
+        products = self.invoice_line_ids.product_id
+        templates = products.product_tmpl_id
+        allowed_templates = (
+            templates.sudo(False)
+            .with_user(dest_user)
+            .with_context(allowed_company_ids=[dest_company.id])
+            ._filter_access_rules("read")
+        )
+        forbidden_products = products.filtered(
+            lambda x: x.product_tmpl_id.id not in allowed_templates.ids
+        )
+        if forbidden_products:
+            raise UserError(
+                _(
+                    "You cannot create invoice in company '%s' with "
+                    "product '%s' because it is not multicompany"
                 )
+                % (dest_company.name, "', '".join(forbidden_products.mapped("name")))
+            )
 
     def _inter_company_create_invoice(self, dest_company):
         """create an invoice for the given company : it will copy
             the invoice lines in the new invoice.
+            When overridden, the invoices are created one at a time through
+            this method instead of in batch.
         :param dest_company : the company of the created invoice
         :rtype dest_company : res.company record
         """
         self.ensure_one()
+        dest_invoice = self._inter_company_create_invoices(dest_company)
+        return {"dest_invoice": dest_invoice}
+
+    def _inter_company_create_invoices(self, dest_company):
+        """Create the invoices of the given company for all these invoices at
+        once: one `create` for the invoices, one for their lines and one
+        validation for the whole batch. The counterparts still in draft or
+        cancelled are synchronised in place instead.
+        :param dest_company : the company of the created invoices
+        :return: the created invoices, in the same order as `self`
+        """
         self = self.with_context(check_move_validity=False)
-        # check intercompany product
-        self._check_intercompany_product(dest_company)
-        # if an invoice has already been generated
-        # delete it and force the same number
-        inter_invoice = self.search(
-            [("auto_invoice_id", "=", self.id), ("company_id", "=", dest_company.id)]
+        with self._intercompany_stage("product_check", dest_company):
+            self._check_intercompany_product(dest_company)
+        to_resync = self._get_inter_company_invoices_to_resync(dest_company)
+        to_create = self.filtered(lambda x: x.id not in to_resync)
+        dest_invoices_by_src = {}
+        if to_create:
+            with to_create._intercompany_stage("invoice_data", dest_company):
+                vals_list = to_create._prepare_invoices_data(dest_company)
+            with to_create._intercompany_stage("create", dest_company):
+                created = self.create(vals_list)
+            with to_create._intercompany_stage("line_data", dest_company):
+                line_vals_list = to_create._prepare_invoices_lines_data(
+                    created, dest_company
+                )
+            with to_create._intercompany_stage("create", dest_company):
+                self.env["account.move.line"].create(line_vals_list)
+            with to_create._intercompany_stage("autocomplete", dest_company):
+                for dest_invoice in created:
+                    dest_invoice._move_autocomplete_invoice_lines_values()
+            dest_invoices_by_src.update(zip(to_create.ids, created))
+        to_resync_invoices = self - to_create
+        with to_resync_invoices._intercompany_stage("resync", dest_company):
+            for src_invoice in to_resync_invoices:
+                dest_invoices_by_src[
+                    src_invoice.id
+                ] = src_invoice._inter_company_resync(
+                    to_resync[src_invoice.id], dest_company
+                )
+        dest_invoices = self.browse(
+            [dest_invoices_by_src[src_id].id for src_id in self.ids]
         )
-        force_number = False
-        if inter_invoice and inter_invoice.state in ["draft", "cancel"]:
-            force_number = inter_invoice.name
-            inter_invoice.with_context(force_delete=True).unlink()
-        # create invoice
-        dest_invoice_data = self._prepare_invoice_data(dest_company)
-        if force_number:
-            dest_invoice_data["name"] = force_number
-        dest_invoice = self.create(dest_invoice_data)
-        # create invoice lines
-        dest_move_line_data = []
-        form = Form(
-            dest_invoice.with_company(dest_company.id),
-            "account_invoice_inter_company.view_move_form",
+        with self._intercompany_stage("post", dest_company):
+            self._validate_dest_invoices(dest_invoices, dest_company)
+        return dest_invoices
+
+    def _get_intercompany_instrumentation(self):
+        """Return the instrumentation mode of the inter company invoices
+        creation, set by the ``account_invoice_inter_company.instrumentation``
+        system parameter: ``log``, ``store`` (log and store) or nothing.
+        """
+        return (
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("account_invoice_inter_company.instrumentation")
         )
-        for src_line in self.invoice_line_ids.filtered(lambda x: not x.display_type):
-            if not src_line.product_id:
-                raise UserError(
-                    _(
-                        "The invoice line '%s' doesn't have a product. "
-                        "All invoice lines should have a product for "
-                        "inter-company invoices."
-                    )
-                    % src_line.name
+
+    @contextmanager
+    def _intercompany_stage(self, stage, dest_company=None):
+        """Measure the wall time and the SQL queries of a stage of the inter
+        company invoices creation, for these invoices.
+        """
+        mode = self._get_intercompany_instrumentation()
+        if not self or mode not in ("log", "store"):
+            yield
+            return
+        cr = self.env.cr
+        query_count = cr.sql_log_count
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            query_count = cr.sql_log_count - query_count
+            _stats_logger.info(
+                "stage=%s dest_company=%s invoices=%s duration_ms=%.1f queries=%s",
+                stage,
+                dest_company and dest_company.id,
+                len(self),
+                duration,
+                query_count,
+            )
+            if mode == "store":
+                cr.cache.setdefault("account_invoice_inter_company_stats", []).append(
+                    {
+                        "stage": stage,
+                        "dest_company_id": dest_company and dest_company.id,
+                        "invoice_count": len(self),
+                        "duration": duration,
+                        "query_count": query_count,
+                    }
                 )
-            dest_move_line_data.append(
-                src_line._prepare_account_move_line(dest_invoice, dest_company, form)
+
+    def _store_intercompany_stats(self):
+        """Save the measures of the stages run so far"""
+        stats = self.env.cr.cache.pop("account_invoice_inter_company_stats", None)
+        if stats:
+            self.env["account.invoice.inter.company.stat"].sudo().create(stats)
+
+    def _get_inter_company_invoices_to_resync(self, dest_company):
+        """Return the counterparts of these invoices in `dest_company` that are
+        in draft or cancelled, and can thus be synchronised in place. When the
+        destination invoices are built through forms, they are recreated.
+
+        :return: dict {source invoice id: counterpart}
+        """
+        if dest_company.intercompany_invoice_use_form:
+            return {}
+        inter_invoices = self.search(
+            [
+                ("auto_invoice_id", "in", self.ids),
+                ("company_id", "=", dest_company.id),
+                ("state", "in", ["draft", "cancel"]),
+            ]
+        )
+        to_resync = {}
+        for inter_invoice in inter_invoices:
+            to_resync.setdefault(inter_invoice.auto_invoice_id.id, inter_invoice)
+        return to_resync
+
+    def _inter_company_resync(self, dest_invoice, dest_company):
+        """Apply to `dest_invoice`, a draft or cancelled counterpart of this
+        invoice, only the changes since it was generated, keeping its lines
+        matched through `auto_invoice_line_id`: changed lines are updated,
+        missing ones created and the other ones removed.
+        :return: the synchronised invoice
+        """
+        self.ensure_one()
+        if dest_invoice.state == "cancel":
+            dest_invoice.button_draft()
+        vals = _get_changed_values(
+            dest_invoice, self._prepare_invoice_data(dest_company)
+        )
+        if vals:
+            # the values of the lines depend on the header, e.g. its currency
+            # or fiscal position
+            dest_invoice.write(vals)
+        dest_lines = dest_invoice.invoice_line_ids
+        dest_lines_by_src = {
+            line.auto_invoice_line_id.id: line
+            for line in dest_lines
+            if line.auto_invoice_line_id
+        }
+        commands = []
+        for line_vals in self._prepare_invoices_lines_data(dest_invoice, dest_company):
+            line_vals.pop("move_id")
+            dest_line = dest_lines_by_src.get(line_vals["auto_invoice_line_id"])
+            if not dest_line:
+                commands.append((0, 0, line_vals))
+                continue
+            dest_lines -= dest_line
+            line_changes = _get_changed_values(dest_line, line_vals)
+            if line_changes:
+                commands.append((1, dest_line.id, line_changes))
+        commands += [(2, line.id) for line in dest_lines]
+        if vals or commands:
+            # going through invoice_line_ids recomputes the tax and payment
+            # term lines
+            dest_invoice.write({"invoice_line_ids": commands})
+        return dest_invoice
+
+    def _prepare_invoices_data(self, dest_company):
+        """Return the values of the counterparts of these invoices. If an
+        invoice has already been generated, delete it and force the same
+        number.
+        """
+        inter_invoices = self.search(
+            [("auto_invoice_id", "in", self.ids), ("company_id", "=", dest_company.id)]
+        )
+        force_numbers = {}
+        to_delete = self.browse()
+        for src_invoice in self:
+            inter_invoice = inter_invoices.filtered(
+                lambda x: x.auto_invoice_id == src_invoice
+            )
+            if inter_invoice and inter_invoice.state in ["draft", "cancel"]:
+                force_numbers[src_invoice.id] = inter_invoice.name
+                to_delete |= inter_invoice
+        to_delete.with_context(force_delete=True).unlink()
+        vals_list = []
+        for src_invoice in self:
+            vals = src_invoice._prepare_invoice_data(dest_company)
+            if src_invoice.id in force_numbers:
+                vals["name"] = force_numbers[src_invoice.id]
+            vals_list.append(vals)
+        return vals_list
+
+    def _prepare_invoices_lines_data(self, dest_invoices, dest_company):
+        """Return the values of the lines of `dest_invoices`, copied from the
+        lines of these invoices, in the same order.
+        """
+        dest_move_line_data = []
+        product_values = {}
+        for src_invoice, dest_invoice in zip(self, dest_invoices):
+            src_lines = src_invoice.invoice_line_ids.filtered(
+                lambda x: not x.display_type
             )
-        self.env["account.move.line"].create(dest_move_line_data)
-        dest_invoice._move_autocomplete_invoice_lines_values()
-        # Validation of account invoice
+            form = values = None
+            if dest_company.intercompany_invoice_use_form:
+                form = Form(
+                    dest_invoice.with_company(dest_company.id),
+                    "account_invoice_inter_company.view_move_form",
+                )
+            else:
+                # account and taxes only depend on these values, share them
+                # between the invoices of the batch
+                key = (
+                    dest_invoice.move_type,
+                    dest_invoice.journal_id,
+                    dest_invoice.fiscal_position_id,
+                    dest_invoice.commercial_partner_id,
+                )
+                values = product_values.setdefault(key, {})
+                missing_lines = src_lines.filtered(
+                    lambda x: x.product_id and x.product_id.id not in values
+                )
+                if missing_lines:
+                    values.update(
+                        missing_lines._prepare_dest_product_values(dest_invoice)
+                    )
+                src_lines = src_lines.with_context(intercompany_product_values=values)
+            for src_line in src_lines:
+                if not src_line.product_id:
+                    raise UserError(
+                        _(
+                            "The invoice line '%s' doesn't have a product. "
+                            "All invoice lines should have a product for "
+                            "inter-company invoices."
+                        )
+                        % src_line.name
+                    )
+                dest_move_line_data.append(
+                    src_line._prepare_account_move_line(
+                        dest_invoice, dest_company, form
+                    )
+                )
+        return dest_move_line_data
+
+    def _validate_dest_invoices(self, dest_invoices, dest_company):
+        """Post the counterparts having the same total as their source invoice,
+        and add a warning in the chatter of the other ones.
+        """
         precision = self.env["decimal.precision"].precision_get("Account")
-        if dest_company.invoice_auto_validation and not float_compare(
-            self.amount_total, dest_invoice.amount_total, precision_digits=precision
-        ):
-            dest_invoice.action_post()
-        else:
-            # Add warning in chatter if the total amounts are different
-            if float_compare(
-                self.amount_total, dest_invoice.amount_total, precision_digits=precision
+        to_post = self.browse()
+        for src_invoice, dest_invoice in zip(self, dest_invoices):
+            if not float_compare(
+                src_invoice.amount_total,
+                dest_invoice.amount_total,
+                precision_digits=precision,
             ):
-                body = _(
-                    "WARNING!!!!! Failure in the inter-company invoice "
-                    "creation process: the total amount of this invoice "
-                    "is %s but the total amount of the invoice %s "
-                    "in the company %s is %s"
-                ) % (
-                    dest_invoice.amount_total,
-                    self.name,
-                    self.company_id.name,
-                    self.amount_total,
-                )
-                dest_invoice.message_post(body=body)
-        return {"dest_invoice": dest_invoice}
+                if dest_company.invoice_auto_validation:
+                    to_post |= dest_invoice
+                continue
+            # Add warning in chatter if the total amounts are different
+            body = _(
+                "WARNING!!!!! Failure in the inter-company invoice "
+                "creation process: the total amount of this invoice "
+                "is %s but the total amount of the invoice %s "
+                "in the company %s is %s"
+            ) % (
+                dest_invoice.amount_total,
+                src_invoice.name,
+                src_invoice.company_id.name,
+                src_invoice.amount_total,
+            )
+            dest_invoice.message_post(body=body)
+        to_post.action_post()
 
     def _get_destination_invoice_type(self):
         self.ensure_one()
@@ -247,21 +792,26 @@ class AccountMove(models.Model):
                 _('Please define %s journal for this company: "%s" (id:%d).')
                 % (dest_journal_type, dest_company.name, dest_company.id)
             )
-        # Use test.Form() class to trigger propper onchanges on the invoice
-        dest_invoice_data = Form(
-            self.env["account.move"]
-            .with_company(dest_company.id)
-            .with_context(
-                default_move_type=dest_inv_type,
+        if dest_company.intercompany_invoice_use_form:
+            # Use test.Form() class to trigger propper onchanges on the invoice
+            dest_invoice_data = Form(
+                self.env["account.move"]
+                .with_company(dest_company.id)
+                .with_context(
+                    default_move_type=dest_inv_type,
+                )
+            )
+            dest_invoice_data.journal_id = dest_journal
+            dest_invoice_data.partner_id = self.company_id.partner_id
+            dest_invoice_data.ref = self.name
+            dest_invoice_data.invoice_date = self.invoice_date
+            dest_invoice_data.narration = self.narration
+            dest_invoice_data.currency_id = self.currency_id
+            vals = dest_invoice_data._values_to_save(all_fields=True)
+        else:
+            vals = self._prepare_invoice_data_values(
+                dest_company, dest_inv_type, dest_journal
             )
-        )
-        dest_invoice_data.journal_id = dest_journal
-        dest_invoice_data.partner_id = self.company_id.partner_id
-        dest_invoice_data.ref = self.name
-        dest_invoice_data.invoice_date = self.invoice_date
-        dest_invoice_data.narration = self.narration
-        dest_invoice_data.currency_id = self.currency_id
-        vals = dest_invoice_data._values_to_save(all_fields=True)
         vals.update(
             {
                 "invoice_origin": _("%s - Invoice: %s")
@@ -281,51 +831,124 @@ class AccountMove(models.Model):
             vals["partner_shipping_id"] = self.partner_shipping_id.id
         return vals
 
-    def button_draft(self):
-        for move in self:
-            inter_invoice_posted = self.sudo().search(
-                [("auto_invoice_id", "=", move.id), ("state", "=", "posted")], limit=1
+    def _prepare_invoice_data_values(self, dest_company, dest_inv_type, dest_journal):
+        """Compute the values set by the partner and date onchanges of the
+        destination invoice, without going through a form.
+        """
+        self.ensure_one()
+        partner = self.company_id.partner_id.with_company(dest_company)
+        if dest_inv_type in self.get_sale_types():
+            payment_term = partner.property_payment_term_id
+        else:
+            payment_term = partner.property_supplier_payment_term_id
+        if dest_inv_type in self.get_inbound_types():
+            bank_partner = dest_company.partner_id
+        else:
+            bank_partner = partner.commercial_partner_id
+        partner_bank = bank_partner.bank_ids.filtered(
+            lambda bank: not bank.company_id or bank.company_id == dest_company
+        )[:1]
+        fiscal_position = (
+            self.env["account.fiscal.position"]
+            .with_company(dest_company)
+            .get_fiscal_position(
+                partner.id, delivery_id=partner.address_get(["delivery"])["delivery"]
             )
-            if inter_invoice_posted:
-                raise UserError(
-                    _(
-                        "You can't modify this invoice as it has an inter company "
-                        "invoice that's in posted state.\n"
-                        "Invoice %s to %s"
-                    )
-                    % (
-                        inter_invoice_posted.name,
-                        inter_invoice_posted.partner_id.display_name,
-                    )
+        )
+        vals = {
+            "move_type": dest_inv_type,
+            "journal_id": dest_journal.id,
+            "partner_id": partner.id,
+            "ref": self.name,
+            "invoice_date": self.invoice_date,
+            "narration": self.narration,
+            "currency_id": self.currency_id.id,
+            "fiscal_position_id": fiscal_position.id,
+            "invoice_payment_term_id": payment_term.id,
+            "partner_bank_id": partner_bank.id,
+        }
+        if self.invoice_date:
+            vals["date"] = self.invoice_date
+            if not payment_term:
+                vals["invoice_date_due"] = self.invoice_date
+        return vals
+
+    def button_draft(self):
+        inter_invoice_posted = self.sudo().search(
+            [("auto_invoice_id", "in", self.ids), ("state", "=", "posted")], limit=1
+        )
+        if inter_invoice_posted:
+            raise UserError(
+                _(
+                    "You can't modify this invoice as it has an inter company "
+                    "invoice that's in posted state.\n"
+                    "Invoice %s to %s"
+                )
+                % (
+                    inter_invoice_posted.name,
+                    inter_invoice_posted.partner_id.display_name,
                 )
+            )
         return super().button_draft()
 
     def button_cancel(self):
-        for invoice in self:
-            company = invoice._find_company_from_invoice_partner()
-            if company and not invoice.auto_generated:
-                for inter_invoice in self.sudo().search(
-                    [("auto_invoice_id", "=", invoice.id)]
-                ):
-                    inter_invoice.button_draft()
-                    inter_invoice.write(
-                        {
-                            "invoice_origin": _("%s - Canceled Invoice: %s")
-                            % (invoice.company_id.name, invoice.name)
-                        }
-                    )
-                    inter_invoice.button_cancel()
+        invoices = self.filtered(
+            lambda x: not x.auto_generated and x._find_company_from_invoice_partner()
+        )
+        inter_invoices = self.sudo().search([("auto_invoice_id", "in", invoices.ids)])
+        if inter_invoices:
+            inter_invoices.button_draft()
+            inter_invoices_by_origin = defaultdict(list)
+            for inter_invoice in inter_invoices:
+                invoice = inter_invoice.auto_invoice_id
+                origin = _("%s - Canceled Invoice: %s") % (
+                    invoice.company_id.name,
+                    invoice.name,
+                )
+                inter_invoices_by_origin[origin].append(inter_invoice.id)
+            for origin, inter_invoice_ids in inter_invoices_by_origin.items():
+                inter_invoices.browse(inter_invoice_ids).write(
+                    {"invoice_origin": origin}
+                )
+            inter_invoices.button_cancel()
         return super().button_cancel()
 
+    @api.model
+    def _get_amount_check_fields(self):
+        """Fields whose change can alter the total of an invoice"""
+        return {
+            "line_ids",
+            "invoice_line_ids",
+            "currency_id",
+            "invoice_cash_rounding_id",
+            "move_type",
+        }
+
     def write(self, vals):
         res = super().write(vals)
-        if self.env.context.get("skip_check_amount_difference"):
-            return res
-        for move in self.filtered("auto_invoice_id"):
+        # Checked right away rather than in a precommit hook, for the error to
+        # be raised by the write, e.g. when saving the invoice form
+        if (
+            self._get_amount_check_fields().intersection(vals)
+            and not self.env.context.get("skip_check_amount_difference")
+            and any(self.mapped("auto_invoice_id"))
+        ):
+            self._check_amount_difference()
+        return res
+
+    def _check_amount_difference(self):
+        """Check the totals of these auto-generated invoices still match the
+        ones of their source invoice.
+        """
+        moves = self.filtered("auto_invoice_id")
+        # read the totals of all the source invoices at once
+        moves.sudo().auto_invoice_id.mapped("amount_total")
+        for move in moves:
+            src_invoice = move.sudo().auto_invoice_id
             if (
                 float_compare(
                     move.amount_total,
-                    move.sudo().auto_invoice_id.amount_total,
+                    src_invoice.amount_total,
                     precision_rounding=move.currency_id.rounding,
                 )
                 != 0
@@ -336,9 +959,8 @@ class AccountMove(models.Model):
                         "trying to modify the amount, which will differ from the "
                         "source one (%s)"
                     )
-                    % (move.sudo().auto_invoice_id.name)
+                    % (src_invoice.name)
                 )
-        return res
 
 
 class AccountMoveLine(models.Model):
@@ -354,6 +976,37 @@ class AccountMoveLine(models.Model):
         index=True,
     )
 
+    def _prepare_dest_product_values(self, dest_move):
+        """Compute the account and taxes of the products of these lines in the
+        destination invoice, once per distinct product.
+        :param dest_move : the created invoice
+        :rtype dest_move : account.move record
+        :return: dict {product id: line values}
+        """
+        AccountMoveLine = self.env["account.move.line"].with_company(
+            dest_move.company_id
+        )
+        product_values = {}
+        for product in self.product_id:
+            dest_line = AccountMoveLine.new(
+                {
+                    "move_id": dest_move.id,
+                    "product_id": product.id,
+                    "partner_id": dest_move.commercial_partner_id.id,
+                }
+            )
+            account = (
+                dest_line._get_computed_account()
+                or dest_move.journal_id.default_account_id
+            )
+            # Taken by the taxes when the product has none, as in the form
+            dest_line.account_id = account
+            product_values[product.id] = {
+                "account_id": account.id,
+                "tax_ids": [(6, 0, dest_line._get_computed_taxes().ids)],
+            }
+        return product_values
+
     @api.model
     def _prepare_account_move_line(self, dest_move, dest_company, form=False):
         """Generate invoice line values
@@ -361,6 +1014,59 @@ class AccountMoveLine(models.Model):
         :rtype dest_move : account.move record
         :param dest_company : the company of the created invoice
         :rtype dest_company : res.company record
+
+        The account and taxes by product, as returned by
+        `_prepare_dest_product_values`, are shared between the lines through
+        the context key `intercompany_product_values`, for not using a form.
+        """
+        self.ensure_one()
+        product_values = self.env.context.get("intercompany_product_values")
+        if not form and (
+            product_values is not None or not dest_company.intercompany_invoice_use_form
+        ):
+            vals = self._prepare_account_move_line_values(dest_move, product_values)
+        else:
+            vals = self._prepare_account_move_line_form(dest_move, dest_company, form)
+        vals.update({"move_id": dest_move.id, "auto_invoice_line_id": self.id})
+        if self.analytic_account_id and not self.analytic_account_id.company_id:
+            vals["analytic_account_id"] = self.analytic_account_id.id
+            analytic_tags = self.analytic_tag_ids.filtered(lambda x: not x.company_id)
+            if analytic_tags:
+                vals["analytic_tag_ids"] = [(4, x) for x in analytic_tags.ids]
+        return vals
+
+    def _prepare_account_move_line_values(self, dest_move, product_values=None):
+        """Generate invoice line values without going through a form"""
+        self.ensure_one()
+        if product_values is None or (
+            self.product_id and self.product_id.id not in product_values
+        ):
+            product_values = self._prepare_dest_product_values(dest_move)
+        vals = {
+            "display_type": self.display_type,
+            "product_id": self.product_id.id,
+            "name": self.name,
+            "product_uom_id": self.product_uom_id.id,
+            "quantity": self.quantity,
+            # TODO: it's wrong to just copy the price_unit
+            # You have to check if the tax is price_include True or False
+            # in source and target companies
+            "price_unit": self.price_unit,
+            "discount": self.discount,
+            "sequence": self.sequence,
+            "partner_id": dest_move.commercial_partner_id.id,
+            "currency_id": dest_move.currency_id.id,
+        }
+        vals.update(product_values.get(self.product_id.id, {}))
+        # Compatibility with module account_invoice_start_end_dates
+        if hasattr(self, "start_date") and hasattr(self, "end_date"):
+            vals["start_date"] = self.start_date
+            vals["end_date"] = self.end_date
+        return vals
+
+    def _prepare_account_move_line_form(self, dest_move, dest_company, form=False):
+        """Generate invoice line values through a form, triggering the
+        onchanges of the line
         """
         self.ensure_one()
         # Use test.Form() class to trigger propper onchanges on the line
@@ -391,11 +1097,4 @@ class AccountMoveLine(models.Model):
             if hasattr(self, "start_date") and hasattr(self, "end_date"):
                 line_form.start_date = self.start_date
                 line_form.end_date = self.end_date
-        vals = dest_form._values_to_save(all_fields=True)["invoice_line_ids"][0][2]
-        vals.update({"move_id": dest_move.id, "auto_invoice_line_id": self.id})
-        if self.analytic_account_id and not self.analytic_account_id.company_id:
-            vals["analytic_account_id"] = self.analytic_account_id.id
-            analytic_tags = self.analytic_tag_ids.filtered(lambda x: not x.company_id)
-            if analytic_tags:
-                vals["analytic_tag_ids"] = [(4, x) for x in analytic_tags.ids]
-        return vals
+        return dest_form._values_to_save(all_fields=True)["invoice_line_ids"][0][2]
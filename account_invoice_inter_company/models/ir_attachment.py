@@ -0,0 +1,16 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import fields, models
+
+
+class IrAttachment(models.Model):
+
+    _inherit = "ir.attachment"
+
+    intercompany_pdf_signature = fields.Char(
+        string="Inter Company PDF Signature",
+        readonly=True,
+        copy=False,
+        help="Digest of the rendering of the invoice this PDF was generated "
+        "from, attached to its inter company counterpart.",
+    )
@@ -23,6 +23,19 @@ class ResCompany(models.Model):
         help="Responsible user for creation of invoices triggered by "
         "intercompany rules.",
     )
+    intercompany_invoice_use_form = fields.Boolean(
+        string="Use Forms for Inter Company Invoices",
+        help="Build the invoices created by intercompany rules for this company "
+        "by simulating the invoice form, triggering all its onchanges. It is "
+        "slower, but takes into account the modules adding their logic in "
+        "onchanges of the invoice or its lines.",
+    )
+    intercompany_invoice_defer_pdf = fields.Boolean(
+        string="Defer Inter Company Invoice PDF",
+        help="Attach the PDF of the invoices of this company to their inter "
+        "company counterparts after the posting is committed, rendering them "
+        "in batches, instead of while posting.",
+    )
 
     def _compute_share_product(self):
         product_rule = self.env.ref("product.product_comp_rule")
@@ -37,3 +50,23 @@ class ResCompany(models.Model):
             ("company_ids", "=", self.id),
             ("id", "in", group_account_invoice.users.ids),
         ]
+
+    def _get_intercompany_check_user(self):
+        """Return the user of this company whose access rights are checked
+        on the intercompany products, searched once per transaction.
+        """
+        self.ensure_one()
+        cache = self.env.cr.cache.setdefault(
+            "account_invoice_inter_company_check_user", {}
+        )
+        if self.id not in cache:
+            cache[self.id] = (
+                self.env["res.users"].search(self._get_user_domain(), limit=1).id
+            )
+        return self.env["res.users"].browse(cache[self.id])
+
+    def write(self, vals):
+        res = super().write(vals)
+        if "partner_id" in vals or "active" in vals:
+            self.env["account.move"]._recompute_intercompany_dest_company(self)
+        return res
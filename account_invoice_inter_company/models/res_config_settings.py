@@ -21,6 +21,14 @@ class ResConfigSettings(models.TransientModel):
         "intercompany rules. If not set the user initiating the"
         "transaction will be used",
     )
+    intercompany_invoice_use_form = fields.Boolean(
+        related="company_id.intercompany_invoice_use_form",
+        readonly=False,
+    )
+    intercompany_invoice_defer_pdf = fields.Boolean(
+        related="company_id.intercompany_invoice_defer_pdf",
+        readonly=False,
+    )
     company_share_product = fields.Boolean(
         "Share product to all companies",
         help="Share your product to all companies defined in your instance.\n"
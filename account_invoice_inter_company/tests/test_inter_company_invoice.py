@@ -3,6 +3,10 @@
 # Copyright 2020 Tecnativa - Pedro M. Baeza
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+from unittest import mock
+
+from psycopg2 import OperationalError
+
 from odoo import _
 from odoo.exceptions import UserError, ValidationError
 from odoo.tests import tagged
@@ -503,6 +507,28 @@ class TestAccountInvoiceInterCompany(TestAccountInvoiceInterCompanyBase):
                 line_form.price_unit = 33.3
             move_form.save()
 
+    def test_amount_difference_check(self):
+        self.env.ref("product.product_comp_rule").write({"active": False})
+        self.invoice_company_a.action_post()
+        dest_invoice = self.account_move_obj.search(
+            [("auto_invoice_id", "=", self.invoice_company_a.id)]
+        )
+        dest_invoice.button_draft()
+        move_class = type(self.account_move_obj)
+        # Writes not changing the total don't check it
+        with mock.patch.object(move_class, "_check_amount_difference") as check:
+            dest_invoice.message_post(body="Chatter only")
+            dest_invoice.write({"ref": "New reference", "narration": "Note"})
+        check.assert_not_called()
+        with self.assertRaises(UserError):
+            dest_invoice.write(
+                {
+                    "invoice_line_ids": [
+                        (1, dest_invoice.invoice_line_ids[0].id, {"price_unit": 33.3})
+                    ]
+                }
+            )
+
     def test_confirm_invoice_with_child_partner(self):
         # ensure the catalog is shared
         self.env.ref("product.product_comp_rule").write({"active": False})
@@ -627,3 +653,352 @@ class TestAccountInvoiceInterCompany(TestAccountInvoiceInterCompanyBase):
             [("auto_invoice_id", "=", refund_company_a.id)]
         )
         self.assertEqual(len(refund), 1)
+
+    def test_confirm_invoice_form_and_direct_builders(self):
+        """Both ways of building the destination invoice give the same values"""
+        self.env.ref("product.product_comp_rule").write({"active": False})
+        dest_invoices = self.account_move_obj
+        for use_form in (True, False):
+            self.company_b.intercompany_invoice_use_form = use_form
+            invoice = self.invoice_company_a.copy()
+            invoice.action_post()
+            dest_invoices |= self.account_move_obj.search(
+                [("auto_invoice_id", "=", invoice.id)]
+            )
+        form_invoice, direct_invoice = dest_invoices
+        for field_name in (
+            "move_type",
+            "journal_id",
+            "partner_id",
+            "currency_id",
+            "fiscal_position_id",
+            "invoice_payment_term_id",
+            "amount_total",
+            "state",
+        ):
+            self.assertEqual(form_invoice[field_name], direct_invoice[field_name])
+        for form_line, direct_line in zip(
+            form_invoice.invoice_line_ids, direct_invoice.invoice_line_ids
+        ):
+            for field_name in (
+                "product_id",
+                "account_id",
+                "tax_ids",
+                "product_uom_id",
+                "quantity",
+                "price_unit",
+                "price_subtotal",
+            ):
+                self.assertEqual(form_line[field_name], direct_line[field_name])
+
+    def test_counterpart_taxes_from_account(self):
+        """Without taxes on the product, both builders take the account ones"""
+        self.env.ref("product.product_comp_rule").write({"active": False})
+        product_b = self.product_a.with_company(self.company_b)
+        product_b.supplier_taxes_id = False
+        product_b.property_account_expense_id = self.a_expense_company_b
+        tax = self.env["account.tax"].create(
+            {
+                "name": "Expense tax company B",
+                "amount": 10,
+                "type_tax_use": "purchase",
+                "company_id": self.company_b.id,
+            }
+        )
+        self.a_expense_company_b.tax_ids = tax
+        for use_form in (True, False):
+            self.company_b.intercompany_invoice_use_form = use_form
+            invoice = self.invoice_company_a.copy()
+            invoice.action_post()
+            dest_invoice = self.account_move_obj.search(
+                [("auto_invoice_id", "=", invoice.id)]
+            )
+            dest_line = dest_invoice.invoice_line_ids.filtered(
+                lambda x: x.product_id == self.product_a
+            )
+            self.assertEqual(dest_line.account_id, self.a_expense_company_b)
+            self.assertEqual(dest_line.tax_ids, tax)
+
+    def test_create_counterpart_invoices_batch(self):
+        """Counterparts are created at once, failing invoices being left aside"""
+        self.env.ref("product.product_comp_rule").write({"active": True})
+        self.product_a.write({"company_id": False})
+        if "company_ids" in dir(self.product_a):
+            self.product_a.write({"company_ids": [(5, 0, 0)]})
+        product_company_a = self.env["product.product"].create(
+            {"name": "Product company A", "company_id": self.company_a.id}
+        )
+        invoices = self.account_move_obj
+        for _i in range(3):
+            invoices |= self.invoice_company_a.copy()
+        with Form(invoices[1]) as invoice_form:
+            with invoice_form.invoice_line_ids.edit(0) as line_form:
+                line_form.product_id = product_company_a
+        invoices.with_context(account_invoice_inter_company_queued=True).action_post()
+        failed = invoices._create_counterpart_invoices()
+        self.assertEqual(list(failed), invoices[1].ids)
+        self.assertIsInstance(failed[invoices[1].id], UserError)
+        dest_invoices = self.account_move_obj.search(
+            [("auto_invoice_id", "in", invoices.ids)]
+        )
+        self.assertEqual(dest_invoices.auto_invoice_id, invoices[0] | invoices[2])
+        self.assertEqual(set(dest_invoices.mapped("state")), {"posted"})
+        with self.assertRaises(UserError):
+            invoices[1].create_counterpart_invoices()
+
+    def test_create_counterpart_invoices_retryable_error(self):
+        """Concurrency errors are raised rather than the invoices left aside"""
+        self.env.ref("product.product_comp_rule").write({"active": False})
+        invoices = self.invoice_company_a.copy() | self.invoice_company_a.copy()
+        invoices.with_context(account_invoice_inter_company_queued=True).action_post()
+        with mock.patch.object(
+            type(self.account_move_obj),
+            "_inter_company_create_invoices",
+            side_effect=OperationalError("could not serialize access"),
+        ):
+            with self.assertRaises(OperationalError):
+                invoices._create_counterpart_invoices()
+
+    def test_create_counterpart_invoices_sync_failure(self):
+        """Posting raises the first failure, before attaching any PDF"""
+        self.env.ref("product.product_comp_rule").write({"active": True})
+        self.product_a.write({"company_id": False})
+        if "company_ids" in dir(self.product_a):
+            self.product_a.write({"company_ids": [(5, 0, 0)]})
+        product_company_a = self.env["product.product"].create(
+            {"name": "Product company A", "company_id": self.company_a.id}
+        )
+        invoices = self.invoice_company_a.copy() | self.invoice_company_a.copy()
+        with Form(invoices[1]) as invoice_form:
+            with invoice_form.invoice_line_ids.edit(0) as line_form:
+                line_form.product_id = product_company_a
+        move_class = type(self.account_move_obj)
+        with mock.patch.object(
+            move_class, "_inter_company_create_invoices_isolated"
+        ) as isolated, mock.patch.object(
+            move_class, "_attach_original_pdf_report"
+        ) as attach:
+            with self.assertRaises(UserError):
+                invoices.action_post()
+        isolated.assert_not_called()
+        attach.assert_not_called()
+
+    def test_per_invoice_extension_point(self):
+        """Overrides of the per invoice method are still called"""
+        self.env.ref("product.product_comp_rule").write({"active": False})
+        move_class = type(self.account_move_obj)
+        original = move_class._inter_company_create_invoice
+        calls = []
+
+        def _inter_company_create_invoice(move, dest_company):
+            calls.append(move.id)
+            return original(move, dest_company)
+
+        invoices = self.invoice_company_a.copy() | self.invoice_company_a.copy()
+        with mock.patch.object(
+            move_class, "_inter_company_create_invoice", _inter_company_create_invoice
+        ):
+            invoices.action_post()
+        self.assertEqual(sorted(calls), sorted(invoices.ids))
+        self.assertEqual(
+            self.account_move_obj.search(
+                [("auto_invoice_id", "in", invoices.ids)]
+            ).auto_invoice_id,
+            invoices,
+        )
+
+    def test_line_extension_point(self):
+        """Overrides of the line method with its historical signature work"""
+        self.env.ref("product.product_comp_rule").write({"active": False})
+        line_class = type(self.env["account.move.line"])
+        original = line_class._prepare_account_move_line
+
+        def _prepare_account_move_line(line, dest_move, dest_company, form=False):
+            vals = original(line, dest_move, dest_company, form=form)
+            vals["name"] = "Overridden"
+            return vals
+
+        with mock.patch.object(
+            line_class, "_prepare_account_move_line", _prepare_account_move_line
+        ):
+            self.invoice_company_a.action_post()
+        dest_invoice = self.account_move_obj.search(
+            [("auto_invoice_id", "=", self.invoice_company_a.id)]
+        )
+        self.assertEqual(dest_invoice.invoice_line_ids.mapped("name"), ["Overridden"])
+
+    def test_find_company_from_partner(self):
+        company_obj = self.env["res.company"]
+        self.assertEqual(
+            company_obj._find_company_from_partner(self.partner_company_b),
+            self.company_b,
+        )
+        self.assertFalse(
+            company_obj._find_company_from_partner(
+                self.partner_company_b, exclude_company=self.company_b
+            )
+        )
+        # The index follows the changes of the company partner
+        new_partner = self.env["res.partner"].create({"name": "New partner B"})
+        self.company_b.partner_id = new_partner
+        self.assertFalse(company_obj._find_company_from_partner(self.partner_company_b))
+        self.assertEqual(
+            company_obj._find_company_from_partner(new_partner), self.company_b
+        )
+
+    def test_intercompany_dest_company_stored(self):
+        invoice = self.invoice_company_a.copy()
+        self.assertFalse(invoice.intercompany_dest_company_id)
+        invoice.action_post()
+        self.assertEqual(invoice.intercompany_dest_company_id, self.company_b)
+        # Changing the partner of the company resolves the invoices again
+        new_partner = self.env["res.partner"].create({"name": "New partner B"})
+        self.company_b.partner_id = new_partner
+        self.assertFalse(invoice.intercompany_dest_company_id)
+        self.company_b.partner_id = self.partner_company_b
+        self.assertEqual(invoice.intercompany_dest_company_id, self.company_b)
+
+    def test_check_intercompany_product_reports_all_products(self):
+        self.env.ref("product.product_comp_rule").write({"active": True})
+        products = self.env["product.product"].create(
+            [
+                {"name": "Product company A %s" % i, "company_id": self.company_a.id}
+                for i in range(2)
+            ]
+        )
+        invoice = self.invoice_company_a.copy()
+        with Form(invoice) as invoice_form:
+            for product in products:
+                with invoice_form.invoice_line_ids.new() as line_form:
+                    line_form.product_id = product
+                    line_form.price_unit = 10.0
+        with self.assertRaises(UserError) as error:
+            invoice._check_intercompany_product(self.company_b)
+        for product in products:
+            self.assertIn(product.name, str(error.exception))
+
+    def test_defer_pdf_attachment(self):
+        self.company_a.intercompany_invoice_defer_pdf = True
+        self.invoice_company_a.action_post()
+        self.assertTrue(self.invoice_company_a.intercompany_pdf_pending)
+        invoice_company_b = self.account_move_obj.search(
+            [("auto_invoice_id", "=", self.invoice_company_a.id)]
+        )
+        attachment_domain = [
+            ("res_model", "=", "account.move"),
+            ("res_id", "=", invoice_company_b.id),
+        ]
+        self.assertFalse(self.env["ir.attachment"].search(attachment_domain))
+        self.account_move_obj._cron_render_pending_pdf_reports()
+        self.assertFalse(self.invoice_company_a.intercompany_pdf_pending)
+        attachment = self.env["ir.attachment"].search(attachment_domain)
+        self.assertEqual(attachment.name, self.invoice_company_a.name + ".pdf")
+        # An unchanged invoice isn't rendered again, even if written since
+        self.invoice_company_a.write({"intercompany_pdf_pending": True})
+        with mock.patch.object(
+            type(self.account_move_obj), "_render_original_pdf_reports"
+        ) as render:
+            self.account_move_obj._cron_render_pending_pdf_reports()
+        render.assert_not_called()
+        self.assertFalse(self.invoice_company_a.intercompany_pdf_pending)
+        self.assertEqual(
+            self.env["ir.attachment"].search(attachment_domain), attachment
+        )
+        # Any printed content changing renders the invoice again
+        self.invoice_company_a.write(
+            {"narration": "New terms", "intercompany_pdf_pending": True}
+        )
+        self.account_move_obj._cron_render_pending_pdf_reports()
+        new_attachment = (
+            self.env["ir.attachment"].search(attachment_domain) - attachment
+        )
+        self.assertEqual(len(new_attachment), 1)
+        self.assertNotEqual(
+            new_attachment.intercompany_pdf_signature,
+            attachment.intercompany_pdf_signature,
+        )
+
+    def test_cancel_invoices_batch(self):
+        self.env.ref("product.product_comp_rule").write({"active": False})
+        invoices = self.invoice_company_a | self.invoice_company_a.copy()
+        invoices.action_post()
+        dest_invoices = self.account_move_obj.search(
+            [("auto_invoice_id", "in", invoices.ids)]
+        )
+        self.assertEqual(len(dest_invoices), 2)
+        invoices.button_cancel()
+        self.assertEqual(set(dest_invoices.mapped("state")), {"cancel"})
+        for dest_invoice in dest_invoices:
+            self.assertEqual(
+                dest_invoice.invoice_origin,
+                "%s - Canceled Invoice: %s"
+                % (self.company_a.name, dest_invoice.auto_invoice_id.name),
+            )
+
+    def test_resync_cancelled_counterpart(self):
+        self.env.ref("product.product_comp_rule").write({"active": False})
+        self.company_b.invoice_auto_validation = False
+        self.invoice_company_a.action_post()
+        dest_invoice = self.account_move_obj.search(
+            [("auto_invoice_id", "=", self.invoice_company_a.id)]
+        )
+        dest_line = dest_invoice.invoice_line_ids
+        self.invoice_company_a.button_cancel()
+        self.assertEqual(dest_invoice.state, "cancel")
+        self.invoice_company_a.button_draft()
+        with Form(self.invoice_company_a) as invoice_form:
+            with invoice_form.invoice_line_ids.edit(0) as line_form:
+                line_form.price_unit = 500.0
+            with invoice_form.invoice_line_ids.new() as line_form:
+                line_form.product_id = self.product_a
+                line_form.price_unit = 10.0
+        self.invoice_company_a.action_post()
+        # The counterpart is updated in place
+        self.assertEqual(
+            self.account_move_obj.search(
+                [("auto_invoice_id", "=", self.invoice_company_a.id)]
+            ),
+            dest_invoice,
+        )
+        self.assertEqual(dest_invoice.state, "draft")
+        self.assertIn(dest_line, dest_invoice.invoice_line_ids)
+        self.assertEqual(dest_line.price_unit, 500.0)
+        self.assertEqual(len(dest_invoice.invoice_line_ids), 2)
+        self.assertEqual(
+            dest_invoice.invoice_line_ids.auto_invoice_line_id,
+            self.invoice_company_a.invoice_line_ids,
+        )
+
+    def test_resync_currency_change(self):
+        self.env.ref("product.product_comp_rule").write({"active": False})
+        self.company_b.invoice_auto_validation = False
+        self.invoice_company_a.action_post()
+        dest_invoice = self.account_move_obj.search(
+            [("auto_invoice_id", "=", self.invoice_company_a.id)]
+        )
+        self.invoice_company_a.button_cancel()
+        self.invoice_company_a.button_draft()
+        usd = self.env.ref("base.USD")
+        usd.active = True
+        with Form(self.invoice_company_a) as invoice_form:
+            invoice_form.currency_id = usd
+        self.invoice_company_a.action_post()
+        self.assertEqual(dest_invoice.currency_id, usd)
+        self.assertEqual(dest_invoice.line_ids.currency_id, usd)
+        self.assertEqual(dest_invoice.amount_total, self.invoice_company_a.amount_total)
+
+    def test_instrumentation_store(self):
+        self.env.ref("product.product_comp_rule").write({"active": False})
+        self.env["ir.config_parameter"].sudo().set_param(
+            "account_invoice_inter_company.instrumentation", "store"
+        )
+        self.invoice_company_a.action_post()
+        stats = self.env["account.invoice.inter.company.stat"].search([])
+        self.assertTrue(
+            {"partner_resolution", "product_check", "create", "post"}
+            <= set(stats.mapped("stage"))
+        )
+        self.assertEqual(
+            stats.filtered(lambda x: x.stage == "create").dest_company_id,
+            self.company_b,
+        )
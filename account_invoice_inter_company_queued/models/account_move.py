@@ -1,4 +1,17 @@
-from odoo import models
+import hashlib
+from collections import defaultdict
+
+from odoo import _, models
+from odoo.tools import split_every
+
+from odoo.addons.queue_job.exception import RetryableJobError
+from odoo.addons.queue_job.job import identity_exact
+
+
+def _get_slot_lock_key(company_id, slot):
+    """Return the advisory lock key of a counterpart job slot of a company"""
+    key = "account_invoice_inter_company_queued:%s:%s" % (company_id, slot)
+    return int(hashlib.sha1(key.encode()).hexdigest()[:15], 16)
 
 
 class AccountMove(models.Model):
@@ -8,8 +21,130 @@ class AccountMove(models.Model):
     def _post(self, soft=True):
         self = self.with_context(account_invoice_inter_company_queued=True)
         res = super(AccountMove, self)._post(soft=soft)
-        for src_invoice in self.filtered(lambda x: x.is_invoice()):
-            dest_company = src_invoice._find_company_from_invoice_partner()
-            if dest_company and not src_invoice.auto_generated:
-                src_invoice.sudo().with_delay().create_counterpart_invoices()
+        self.filtered(
+            lambda x: x.is_invoice() and not x.auto_generated
+        )._enqueue_counterpart_invoices()
         return res
+
+    def _get_counterpart_job_batch_size(self):
+        return max(
+            int(
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param("account_invoice_inter_company_queued.job_batch_size", 1)
+            ),
+            1,
+        )
+
+    def _enqueue_counterpart_invoices(self, batch_size=None):
+        """Enqueue the creation of the counterparts of these invoices, in jobs
+        of at most `batch_size` invoices of the same destination company.
+
+        The jobs are identified by their invoices, so enqueuing again the same
+        invoices while their job is pending doesn't create a duplicate.
+        """
+        batch_size = batch_size or self._get_counterpart_job_batch_size()
+        groups = defaultdict(list)
+        for src_invoice in self:
+            dest_company = src_invoice._find_company_from_invoice_partner()
+            if dest_company:
+                groups[dest_company].append(src_invoice.id)
+        for dest_company, src_invoice_ids in groups.items():
+            for src_invoices in split_every(
+                batch_size, sorted(src_invoice_ids), self.sudo().browse
+            ):
+                src_invoices.with_delay(
+                    description=_("Create the counterparts in %s of %s invoice(s)")
+                    % (dest_company.name, len(src_invoices)),
+                    identity_key=identity_exact,
+                    channel=dest_company.intercompany_invoice_job_channel_id.complete_name
+                    or None,
+                    priority=dest_company.intercompany_invoice_job_priority,
+                )._create_counterpart_invoices_job()
+
+    def _is_intercompany_retryable_error(self, error):
+        return isinstance(
+            error, RetryableJobError
+        ) or super()._is_intercompany_retryable_error(error)
+
+    def _get_counterpart_job_postpone_seconds(self):
+        seconds = max(
+            int(
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param(
+                    "account_invoice_inter_company_queued.job_postpone_seconds", 60
+                )
+            ),
+            1,
+        )
+        # Spread the postponed jobs for them not to be retried at once
+        return seconds, 2 * seconds
+
+    def _check_counterpart_job_concurrency(self):
+        """Postpone the current job when the destination company of these
+        invoices already has as many counterpart jobs running as allowed.
+
+        A running job holds one of the slots of its destination company until
+        the end of its transaction, whatever its channel, so that jobs started
+        at the same time can't exceed the limit.
+        """
+        dest_company = self[:1]._find_company_from_invoice_partner()
+        if not self.env.context.get("job_uuid") or not dest_company:
+            return
+        max_concurrency = dest_company.intercompany_invoice_job_max_concurrency
+        if max_concurrency <= 0:
+            return
+        if not self._lock_counterpart_job_slot(dest_company, max_concurrency):
+            raise RetryableJobError(
+                _("Too many jobs running for company %s") % dest_company.name,
+                seconds=self._get_counterpart_job_postpone_seconds(),
+                ignore_retry=True,
+            )
+
+    def _lock_counterpart_job_slot(self, dest_company, max_concurrency):
+        """Take a free slot of `dest_company` with a transaction level advisory
+        lock.
+
+        :return: whether a slot was free
+        """
+        for slot in range(max_concurrency):
+            self.env.cr.execute(
+                "SELECT pg_try_advisory_xact_lock(%s)",
+                (_get_slot_lock_key(dest_company.id, slot),),
+            )
+            if self.env.cr.fetchone()[0]:
+                return True
+        return False
+
+    def _filter_counterpart_job_invoices(self):
+        """Return these invoices whose counterpart is still to be created by a
+        job: the ones still posted whose counterpart isn't posted yet, e.g. by
+        another job of a different batch, the invoice having been posted again
+        meanwhile.
+        """
+        done_ids = set(
+            self.sudo()
+            .search([("auto_invoice_id", "in", self.ids), ("state", "=", "posted")])
+            .mapped("auto_invoice_id")
+            .ids
+        )
+        return self.filtered(lambda x: x.state == "posted" and x.id not in done_ids)
+
+    def _create_counterpart_invoices_job(self):
+        """Job creating the counterparts of these invoices. The invoices whose
+        counterpart failed are enqueued again, each in its own job, the other
+        ones being committed.
+        """
+        self._check_counterpart_job_concurrency()
+        invoices = self._filter_counterpart_job_invoices()
+        failed = invoices._create_counterpart_invoices()
+        if not failed:
+            return
+        if len(invoices) == 1:
+            raise failed[invoices.id]
+        self.browse(list(failed))._enqueue_counterpart_invoices(batch_size=1)
+        return _("Counterparts of %s invoice(s) to retry in separate jobs: %s") % (
+            len(failed),
+            ", ".join(self.browse(list(failed)).mapped("name")),
+        )
@@ -0,0 +1,26 @@
+from odoo import fields, models
+
+
+class ResCompany(models.Model):
+
+    _inherit = "res.company"
+
+    intercompany_invoice_job_channel_id = fields.Many2one(
+        comodel_name="queue.job.channel",
+        string="Inter Company Invoice Job Channel",
+        help="Channel of the jobs creating the invoices of this company "
+        "triggered by intercompany rules. Leave empty for using the default "
+        "channel.",
+    )
+    intercompany_invoice_job_priority = fields.Integer(
+        string="Inter Company Invoice Job Priority",
+        default=10,
+        help="Priority of the jobs creating the invoices of this company "
+        "triggered by intercompany rules, the lowest first.",
+    )
+    intercompany_invoice_job_max_concurrency = fields.Integer(
+        string="Inter Company Invoice Jobs Limit",
+        help="Maximum number of jobs creating the invoices of this company run "
+        "at the same time, whatever their channel. The jobs over the limit "
+        "are postponed. 0 means no limit.",
+    )
@@ -9,3 +9,15 @@ class ResConfigSettings(models.TransientModel):
         "Queued Invoices Creation",
         help="This will install account_invoice_inter_company_queued",
     )
+    intercompany_invoice_job_channel_id = fields.Many2one(
+        related="company_id.intercompany_invoice_job_channel_id",
+        readonly=False,
+    )
+    intercompany_invoice_job_priority = fields.Integer(
+        related="company_id.intercompany_invoice_job_priority",
+        readonly=False,
+    )
+    intercompany_invoice_job_max_concurrency = fields.Integer(
+        related="company_id.intercompany_invoice_job_max_concurrency",
+        readonly=False,
+    )
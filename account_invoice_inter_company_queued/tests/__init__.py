@@ -0,0 +1 @@
+from . import test_inter_company_invoice_queued
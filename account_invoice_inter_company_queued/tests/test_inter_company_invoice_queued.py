@@ -0,0 +1,162 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from unittest import mock
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from odoo.addons.account_invoice_inter_company.tests.test_inter_company_invoice import (
+    TestAccountInvoiceInterCompanyBase,
+)
+from odoo.addons.queue_job.exception import RetryableJobError
+from odoo.addons.queue_job.job import Job
+
+from ..models.account_move import _get_slot_lock_key
+
+
+@tagged("post_install", "-at_install")
+class TestAccountInvoiceInterCompanyQueued(TestAccountInvoiceInterCompanyBase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env.ref("product.product_comp_rule").write({"active": False})
+        cls.job_obj = cls.env["queue.job"]
+        cls.move_class = type(cls.account_move_obj)
+
+    def _get_jobs(self):
+        return self.job_obj.search(
+            [
+                ("model_name", "=", "account.move"),
+                ("method_name", "=", "_create_counterpart_invoices_job"),
+            ]
+        )
+
+    def _get_invoices(self, count):
+        invoices = self.account_move_obj
+        for _i in range(count):
+            invoices |= self.invoice_company_a.copy()
+        return invoices
+
+    def _perform(self, job):
+        job = Job.load(self.env, job.uuid)
+        job.perform()
+        return job.result
+
+    def test_enqueue_batches(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "account_invoice_inter_company_queued.job_batch_size", 2
+        )
+        invoices = self._get_invoices(3)
+        invoices.action_post()
+        jobs = self._get_jobs()
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual(sorted(len(job.record_ids) for job in jobs), [1, 2])
+        self.assertEqual(sorted(sum(jobs.mapped("record_ids"), [])), invoices.ids)
+        self.assertFalse(
+            self.account_move_obj.search([("auto_invoice_id", "in", invoices.ids)])
+        )
+        for job in jobs:
+            self._perform(job)
+        dest_invoices = self.account_move_obj.search(
+            [("auto_invoice_id", "in", invoices.ids)]
+        )
+        self.assertEqual(dest_invoices.auto_invoice_id, invoices)
+
+    def test_enqueue_identity(self):
+        invoice = self._get_invoices(1)
+        invoice.action_post()
+        self.assertEqual(len(self._get_jobs()), 1)
+        invoice.button_draft()
+        invoice.action_post()
+        self.assertEqual(len(self._get_jobs()), 1)
+
+    def test_repost_invoice_of_batch(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "account_invoice_inter_company_queued.job_batch_size", 2
+        )
+        invoices = self._get_invoices(2)
+        invoices.action_post()
+        job = self._get_jobs()
+        invoices[0].button_draft()
+        invoices[0].action_post()
+        new_job = self._get_jobs() - job
+        self.assertEqual(new_job.record_ids, invoices[0].ids)
+        self._perform(job)
+        self._perform(new_job)
+        dest_invoices = self.account_move_obj.search(
+            [("auto_invoice_id", "in", invoices.ids)]
+        )
+        self.assertEqual(len(dest_invoices), 2)
+        self.assertEqual(dest_invoices.auto_invoice_id, invoices)
+
+    def test_failed_invoices_requeued(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "account_invoice_inter_company_queued.job_batch_size", 3
+        )
+        invoices = self._get_invoices(3)
+        invoices.action_post()
+        job = self._get_jobs()
+        failed = {invoices[1].id: UserError("Failed")}
+        with mock.patch.object(
+            self.move_class, "_create_counterpart_invoices", return_value=failed
+        ):
+            result = self._perform(job)
+        self.assertIn(invoices[1].name, result)
+        new_job = self._get_jobs() - job
+        self.assertEqual(new_job.record_ids, invoices[1].ids)
+        with mock.patch.object(
+            self.move_class, "_create_counterpart_invoices", return_value=failed
+        ):
+            with self.assertRaises(UserError):
+                self._perform(new_job)
+
+    def test_retryable_error_raised(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "account_invoice_inter_company_queued.job_batch_size", 2
+        )
+        invoices = self._get_invoices(2)
+        invoices.action_post()
+        job = self._get_jobs()
+        with mock.patch.object(
+            self.move_class,
+            "_inter_company_create_invoices",
+            side_effect=RetryableJobError("Retry"),
+        ):
+            with self.assertRaises(RetryableJobError):
+                self._perform(job)
+        self.assertEqual(len(self._get_jobs()), 1)
+
+    def _get_dest_invoices(self, invoices):
+        return self.account_move_obj.search([("auto_invoice_id", "in", invoices.ids)])
+
+    def test_concurrency_postponed(self):
+        self.company_b.intercompany_invoice_job_max_concurrency = 1
+        invoice = self._get_invoices(1)
+        invoice.action_post()
+        job = self._get_jobs()
+        # A job of the same company running in another transaction
+        with self.registry.cursor() as cr:
+            cr.execute(
+                "SELECT pg_advisory_xact_lock(%s)",
+                (_get_slot_lock_key(self.company_b.id, 0),),
+            )
+            with self.assertRaises(RetryableJobError) as error:
+                self._perform(job)
+            self.assertTrue(error.exception.ignore_retry)
+            self.assertEqual(error.exception.seconds, (60, 120))
+            self.assertFalse(self._get_dest_invoices(invoice))
+        self._perform(job)
+        self.assertTrue(self._get_dest_invoices(invoice))
+
+    def test_concurrency_free_slot(self):
+        self.company_b.intercompany_invoice_job_max_concurrency = 2
+        invoice = self._get_invoices(1)
+        invoice.action_post()
+        job = self._get_jobs()
+        with self.registry.cursor() as cr:
+            cr.execute(
+                "SELECT pg_advisory_xact_lock(%s)",
+                (_get_slot_lock_key(self.company_b.id, 0),),
+            )
+            self._perform(job)
+        self.assertTrue(self._get_dest_invoices(invoice))
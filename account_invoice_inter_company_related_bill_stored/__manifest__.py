@@ -0,0 +1,13 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+{
+    "name": "Inter Company Invoices Stored Related Bill",
+    "summary": "Store the related bill of inter company invoices",
+    "version": "14.0.1.0.0",
+    "category": "Accounting & Finance",
+    "website": "https://github.com/OCA/multi-company",
+    "author": "Odoo Community Association (OCA)",
+    "license": "AGPL-3",
+    "depends": ["account_invoice_inter_company"],
+    "installable": True,
+}
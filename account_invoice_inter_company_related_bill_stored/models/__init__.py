@@ -0,0 +1 @@
+from . import account_move
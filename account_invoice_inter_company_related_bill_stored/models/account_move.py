@@ -0,0 +1,35 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import api, fields, models
+
+
+class AccountMove(models.Model):
+
+    _inherit = "account.move"
+
+    related_bill_name = fields.Char(
+        compute="_compute_related_bill_info",
+        store=True,
+    )
+    related_bill_company_id = fields.Many2one(
+        compute="_compute_related_bill_info",
+        store=True,
+        index=True,
+    )
+
+    @api.depends(
+        "related_bill_ids",
+        "related_bill_ids.name",
+        "related_bill_ids.state",
+        "related_bill_ids.date",
+        "related_bill_ids.company_id",
+    )
+    def _compute_related_bill_info(self):
+        self._compute_related_bill_values(
+            ["related_bill_name", "related_bill_company_id"]
+        )
+
+    @api.depends_context("allowed_company_ids")
+    def _compute_related_bill(self):
+        # Stored and non stored fields can't share their compute method
+        self._compute_related_bill_values(["related_bill_id"])
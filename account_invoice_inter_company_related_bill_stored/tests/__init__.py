@@ -0,0 +1 @@
+from . import test_related_bill_stored
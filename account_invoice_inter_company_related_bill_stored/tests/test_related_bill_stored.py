@@ -0,0 +1,36 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tests import tagged
+
+from odoo.addons.account_invoice_inter_company.tests.test_inter_company_invoice import (
+    TestAccountInvoiceInterCompanyBase,
+)
+
+
+@tagged("post_install", "-at_install")
+class TestRelatedBillStored(TestAccountInvoiceInterCompanyBase):
+    def test_related_bill_stored(self):
+        self.env.ref("product.product_comp_rule").write({"active": False})
+        self.invoice_company_a.action_post()
+        dest_invoice = self.account_move_obj.search(
+            [("auto_invoice_id", "=", self.invoice_company_a.id)]
+        )
+        self.assertEqual(
+            self.invoice_company_a.related_bill_name, dest_invoice.display_name
+        )
+        self.assertEqual(
+            self.account_move_obj.search(
+                [("related_bill_company_id", "=", self.company_b.id)]
+            ),
+            self.invoice_company_a,
+        )
+        groups = self.account_move_obj.read_group(
+            [("id", "=", self.invoice_company_a.id)],
+            ["related_bill_company_id"],
+            ["related_bill_company_id"],
+        )
+        self.assertEqual(groups[0]["related_bill_company_id"][0], self.company_b.id)
+        dest_invoice.button_draft()
+        dest_invoice.button_cancel()
+        dest_invoice.with_context(force_delete=True).unlink()
+        self.assertFalse(self.invoice_company_a.related_bill_company_id)
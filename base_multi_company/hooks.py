@@ -1,13 +1,38 @@
 # Copyright 2015-2016 Pedro M. Baeza <pedro.baeza@tecnativa.com>
 # Copyright 2017 LasLabs Inc.
 # License LGPL-3 - See http://www.gnu.org/licenses/lgpl-3.0.html
+import logging
+
 from odoo import SUPERUSER_ID, api
+from odoo.tools import sql, str2bool
+
+_logger = logging.getLogger(__name__)
 
 __all__ = [
+    "fill_company_ids",
+    "get_security_rule_domain",
     "post_init_hook",
     "uninstall_hook",
 ]
 
+BACKFILL_BATCH_SIZE = 100000
+
+
+def get_security_rule_domain(model):
+    """Return the multi-company record rule domain for the given model.
+
+    If the model keeps `company_ids` in an array column
+    (`_company_ids_array`) or in company sets (`_company_set`), the rule goes
+    through `company_ids_match` for using them.
+
+    :param: model: Model inheriting from `multi.company.abstract`.
+    """
+    if getattr(model, "_company_ids_array", False) or getattr(
+        model, "_company_set", False
+    ):
+        return "[('company_ids_match', 'in', company_ids)]"
+    return "['|', ('no_company_ids', '=', True), ('company_ids', 'in', company_ids)]"
+
 
 def set_security_rule(env, rule_ref):
     """Set the condition for multi-company in the security rule.
@@ -21,10 +46,7 @@ def set_security_rule(env, rule_ref):
     rule.write(
         {
             "active": True,
-            "domain_force": (
-                "['|', ('no_company_ids', '=', True), ('company_ids', "
-                "'in', company_ids)]"
-            ),
+            "domain_force": get_security_rule_domain(env[rule.model_id.model]),
         }
     )
 
@@ -43,22 +65,143 @@ def post_init_hook(cr, rule_ref, model_name):
         env = api.Environment(cr, SUPERUSER_ID, {})
         set_security_rule(env, rule_ref)
         # Copy company values
-        model = env[model_name]
-        table_name = model._fields["company_ids"].relation
-        column1 = model._fields["company_ids"].column1
-        column2 = model._fields["company_ids"].column2
-        SQL = """
-            INSERT INTO {}
-            ({}, {})
-            SELECT id, company_id FROM {} WHERE company_id IS NOT NULL
+        get_param = env["ir.config_parameter"].sudo().get_param
+        fill_company_ids(
+            env,
+            model_name,
+            batch_size=int(
+                get_param("base_multi_company.backfill_batch_size", BACKFILL_BATCH_SIZE)
+            ),
+            commit=str2bool(
+                get_param("base_multi_company.backfill_commit", "False"), default=False
+            ),
+        )
+
+
+def fill_company_ids(env, model_name, batch_size=BACKFILL_BATCH_SIZE, commit=False):
+    """Copy `company_id` into `company_ids` by chunks of ids.
+
+    The secondary indexes of the relation table are dropped during the load
+    and built again afterwards, then `no_company_ids` is set with set-based
+    updates. When `commit` is set, each chunk is committed and the next id
+    to process by each step is stored in a system parameter, kept until the
+    whole backfill succeeds, so an interrupted run resumes where it stopped
+    when called again, skipping the steps already done.
+
+    Args:
+        env (Environment): Environment to use for operation.
+        model_name (string): Name of the multi-company model to fill.
+        batch_size (int): Number of ids processed by each statement.
+        commit (bool): Commit after each chunk for making the run resumable.
+    """
+    cr = env.cr
+    model = env[model_name]
+    model.flush()
+    field = model._fields["company_ids"]
+    table, relation = model._table, field.relation
+    column1, column2 = field.column1, field.column2
+    progress_key = "base_multi_company.backfill.%s" % model_name
+    config = env["ir.config_parameter"].sudo()
+    cr.execute('SELECT MIN(id), MAX(id) FROM "{}"'.format(table))
+    min_id, max_id = cr.fetchone()
+    if max_id is None:
+        return
+    # Drop the indexes of the relation table not backing its primary key,
+    # they are built again once the data is loaded
+    cr.execute(
+        """
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE tablename = %s AND indexname NOT IN (
+            SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass
+        )
+        """,
+        (relation, relation),
+    )
+    indexes = cr.fetchall()
+    for index_name, _index_def in indexes:
+        cr.execute('DROP INDEX "{}"'.format(index_name))
+    _logger.info("Filling %s from %s.company_id", relation, table)
+    steps = [
+        (
+            "company_ids",
+            """
+            INSERT INTO "{relation}" ("{column1}", "{column2}")
+            SELECT id, company_id FROM "{table}"
+            WHERE company_id IS NOT NULL AND id BETWEEN %s AND %s
             ON CONFLICT DO NOTHING
-        """.format(
-            table_name,
-            column1,
-            column2,
-            model._table,
+            """.format(
+                table=table, relation=relation, column1=column1, column2=column2
+            ),
+        ),
+        (
+            "no_company_ids",
+            """
+            UPDATE "{table}" t SET no_company_ids = rel.no_company_ids
+            FROM (
+                SELECT t2.id, NOT EXISTS (
+                    SELECT 1 FROM "{relation}" r WHERE r."{column1}" = t2.id
+                ) AS no_company_ids
+                FROM "{table}" t2
+                WHERE t2.id BETWEEN %s AND %s
+            ) rel
+            WHERE t.id = rel.id
+                AND t.no_company_ids IS DISTINCT FROM rel.no_company_ids
+            """.format(
+                table=table, relation=relation, column1=column1
+            ),
+        ),
+    ]
+    if model._company_ids_array:
+        # no_company_ids is updated together with the array
+        steps[1] = (
+            "company_ids_array",
+            model._get_company_ids_array_sync_query("WHERE t2.id BETWEEN %s AND %s"),
+        )
+    if model._company_set:
+        steps.append(
+            (
+                "company_set_id",
+                lambda start, stop: env["multi.company.set"]._sync_records(
+                    model, "WHERE t2.id BETWEEN %s AND %s", (start, stop)
+                ),
+            )
+        )
+    step_keys = []
+    for step, query in steps:
+        step_key = "{}.{}".format(progress_key, step)
+        step_keys.append(step_key)
+        start = int(config.get_param(step_key, min_id))
+        while start <= max_id:
+            stop = start + batch_size - 1
+            if callable(query):
+                query(start, stop)
+            else:
+                cr.execute(query, (start, stop))
+            _logger.info(
+                "%s.%s: ids %s to %s of %s done", table, step, start, stop, max_id
+            )
+            start = stop + 1
+            if commit:
+                config.set_param(step_key, start)
+                cr.commit()
+    for _index_name, index_def in indexes:
+        cr.execute(index_def)
+    if not indexes:
+        # Resumed run: the indexes were dropped by the interrupted one
+        sql.create_index(
+            cr,
+            "{}_{}_{}_idx".format(relation, column2, column1),
+            relation,
+            ['"{}"'.format(column2), '"{}"'.format(column1)],
         )
-        env.cr.execute(SQL)
+    fnames = ["company_ids", "no_company_ids"]
+    if model._company_set:
+        fnames.append("company_set_id")
+    model.invalidate_cache(fnames)
+    if commit:
+        for step_key in step_keys:
+            config.set_param(step_key, False)
+        cr.commit()
 
 
 def uninstall_hook(cr, rule_ref):
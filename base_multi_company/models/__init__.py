@@ -3,3 +3,4 @@
 
 from . import base
 from . import multi_company_abstract
+from . import multi_company_set
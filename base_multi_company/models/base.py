@@ -1,6 +1,8 @@
 # Copyright 2023 Tecnativa - Pedro M. Baeza
 # License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl.html).
 
+from collections import defaultdict
+
 from odoo import models
 
 
@@ -12,14 +14,28 @@ class Base(models.AbstractModel):
         for being taking into account when computing the company of many2one's
         relations that links with our multi-company models.
 
-        We have to serialize the call to super, but it doesn't matter in terms of
-        performance, as super also makes a for loop in the records.
+        Records are grouped by their source company, so super is called once per
+        distinct company with the context set only once, instead of switching the
+        environment (and thus its cache) for each record.
+        """
+        for company_source_id, records in self._group_by_check_company_source():
+            records = records.with_context(_check_company_source_id=company_source_id)
+            super(Base, records)._check_company(fnames=fnames)
+
+    def _group_by_check_company_source(self):
+        """Split the recordset by the company used as ``_check_company_source_id``.
+
+        :return: list of ``(company_id, records)`` tuples, keeping the order in
+            which each company first appears.
         """
+        if self._name == "res.company":
+            return [(record.id, record) for record in self]
+        if "company_id" not in self._fields:
+            return [(False, self)] if self else []
+        groups = defaultdict(list)
         for record in self:
-            company_source_id = False
-            if record._name == "res.company":
-                company_source_id = self.id
-            elif "company_id" in record._fields:
-                company_source_id = record.company_id.id
-            self = self.with_context(_check_company_source_id=company_source_id)
-            super()._check_company(fnames=fnames)
+            groups[record.company_id.id].append(record.id)
+        return [
+            (company_id, self.browse(record_ids))
+            for company_id, record_ids in groups.items()
+        ]
@@ -2,7 +2,13 @@
 # Copyright 2023 Tecnativa - Pedro M. Baeza
 # License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl.html).
 
-from odoo import api, fields, models
+from collections import defaultdict
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+from odoo.osv import expression
+from odoo.osv.expression import FALSE_LEAF, TRUE_LEAF
+from odoo.tools import sql
 
 
 class MultiCompanyAbstract(models.AbstractModel):
@@ -10,6 +16,17 @@ class MultiCompanyAbstract(models.AbstractModel):
     _name = "multi.company.abstract"
     _description = "Multi-Company Abstract"
 
+    # Set it to True on an inheriting model for keeping a denormalized copy of
+    # `company_ids` in an integer array column covered by a GIN index. The
+    # record rule can then use `company_ids_match`, which compares that column
+    # with the allowed companies instead of querying the relation table.
+    _company_ids_array = False
+    # Set it to True on an inheriting model for linking each record to the
+    # `multi.company.set` of its companies through `company_set_id`, which is
+    # then indexed. `company_ids_match` then compares that column with the sets
+    # visible by the allowed companies.
+    _company_set = False
+
     company_id = fields.Many2one(
         string="Company",
         comodel_name="res.company",
@@ -29,6 +46,174 @@ class MultiCompanyAbstract(models.AbstractModel):
         store=True,
         index=True,
     )
+    company_ids_match = fields.Boolean(
+        string="Company Match",
+        compute="_compute_company_ids_match",
+        search="_search_company_ids_match",
+        help="Technical field for the record rules. Searching it with a list of "
+        "companies returns the records shared with any of them or with no "
+        "company at all.",
+    )
+
+    @api.model
+    def _add_magic_fields(self):
+        super()._add_magic_fields()
+        # Only on the models setting `_company_set`, for not adding a column to
+        # the tables of the other ones. Filled with SQL.
+        if self._company_set:
+            self._add_field(
+                "company_set_id",
+                fields.Many2one(
+                    string="Company Set",
+                    comodel_name="multi.company.set",
+                    readonly=True,
+                    copy=False,
+                    prefetch=False,
+                ),
+            )
+
+    def _auto_init(self):
+        if self._auto and sql.table_exists(self.env.cr, self._table):
+            self._init_no_company_ids()
+        res = super()._auto_init()
+        if self._auto and self._company_ids_array:
+            self._init_company_ids_array()
+        if self._auto and self._company_set:
+            self._init_company_set()
+        return res
+
+    def _init_no_company_ids(self):
+        """Create `no_company_ids` on existing tables before the ORM does it.
+
+        `company_ids` is not created yet, so it will be empty for all records
+        and the column gets its value from a default instead of an ORM
+        recompute of every record of the table. The hooks fix it after filling
+        `company_ids`.
+        """
+        cr = self.env.cr
+        if sql.column_exists(cr, self._table, "no_company_ids") or sql.table_exists(
+            cr, self._fields["company_ids"].relation
+        ):
+            return
+        cr.execute(
+            """
+            ALTER TABLE "{table}" ADD COLUMN no_company_ids boolean DEFAULT TRUE;
+            ALTER TABLE "{table}" ALTER COLUMN no_company_ids DROP DEFAULT;
+            """.format(
+                table=self._table
+            )
+        )
+
+    def _init_company_ids_array(self):
+        """Create, fill and index the `company_ids_array` column if missing."""
+        cr = self.env.cr
+        if not sql.column_exists(cr, self._table, "company_ids_array"):
+            cr.execute(
+                """
+                ALTER TABLE "{}"
+                ADD COLUMN company_ids_array int4[] NOT NULL DEFAULT '{{}}'
+                """.format(
+                    self._table
+                )
+            )
+            cr.execute(self._get_company_ids_array_sync_query())
+        cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS "{table}_company_ids_array_gin"
+            ON "{table}" USING gin (company_ids_array)
+            """.format(
+                table=self._table
+            )
+        )
+
+    def _init_company_set(self):
+        """Fill the `company_set_id` column of the records without it, and
+        index it.
+        """
+        cr = self.env.cr
+        cr.execute(
+            'SELECT 1 FROM "{}" WHERE company_set_id IS NULL LIMIT 1'.format(
+                self._table
+            )
+        )
+        if cr.fetchone():
+            self.env["multi.company.set"]._sync_records(
+                self, "WHERE t2.company_set_id IS NULL", ()
+            )
+        sql.create_index(
+            cr,
+            "{}_company_set_id_index".format(self._table),
+            self._table,
+            ["company_set_id"],
+        )
+
+    def _sync_company_set(self):
+        """Link these records to the `multi.company.set` of their companies."""
+        if not self:
+            return
+        self.env["multi.company.set"]._sync_records(
+            self, "WHERE t2.id IN %s", (tuple(self.ids),)
+        )
+        self.invalidate_cache(["company_set_id"], self.ids)
+
+    def _sync_company_ids_storage(self):
+        """Update the denormalized storages of `company_ids` of these records."""
+        if self._company_ids_array:
+            self._sync_company_ids_array()
+        if self._company_set:
+            self._sync_company_set()
+
+    def _sync_company_ids_array(self):
+        """Copy `company_ids` of these records into `company_ids_array`."""
+        if not self:
+            return
+        self.env.cr.execute(
+            self._get_company_ids_array_sync_query("WHERE t2.id IN %s"),
+            (tuple(self.ids),),
+        )
+
+    @api.model
+    def _get_company_ids_array_sync_query(self, where=""):
+        """Return the UPDATE statement copying the relation table content into
+        `company_ids_array`, restricted by the `where` clause on `t2`.
+        `no_company_ids` is updated in the same statement.
+        """
+        field = self._fields["company_ids"]
+        return """
+            UPDATE "{table}" t
+            SET company_ids_array = rel.company_ids,
+                no_company_ids = rel.company_ids = '{{}}'
+            FROM (
+                SELECT t2.id, ARRAY(
+                    SELECT r."{column2}" FROM "{relation}" r
+                    WHERE r."{column1}" = t2.id ORDER BY r."{column2}"
+                ) AS company_ids
+                FROM "{table}" t2
+                {where}
+            ) rel
+            WHERE t.id = rel.id
+                AND t.company_ids_array IS DISTINCT FROM rel.company_ids
+        """.format(
+            table=self._table,
+            relation=field.relation,
+            column1=field.column1,
+            column2=field.column2,
+            where=where,
+        )
+
+    def _compute_company_ids_match(self):
+        self.company_ids_match = True
+
+    def _search_company_ids_match(self, operator, value):
+        if operator not in ("in", "="):
+            raise UserError(_("Operation not supported"))
+        if not value:
+            company_ids = []
+        elif isinstance(value, int):
+            company_ids = [value]
+        else:
+            company_ids = [company_id for company_id in value if company_id]
+        return self._get_company_ids_domain("in", company_ids + [False])
 
     @api.depends("company_ids")
     def _compute_no_company_ids(self):
@@ -41,28 +226,50 @@ class MultiCompanyAbstract(models.AbstractModel):
     @api.depends("company_ids")
     @api.depends_context("company", "_check_company_source_id")
     def _compute_company_id(self):
+        # Set this priority computing the company (if included in the allowed ones)
+        # for avoiding multi company incompatibility errors:
+        # - If this call is done from method _check_company, the company of the
+        #   record to be compared.
+        # - Otherwise, current company of the user.
+        company_id = (
+            self.env.context.get("_check_company_source_id")
+            or self.env.context.get("force_company")
+            or self.env.company.id
+        )
+        # Fetch the companies of the whole recordset at once. They are kept in
+        # the transaction cache, which doesn't depend on the context, so
+        # switching the current company doesn't read them again.
+        self.mapped("company_ids")
+        # Most records share a few company sets, so resolve each set only once
+        resolved = {}
+        groups = defaultdict(list)
         for record in self:
-            # Set this priority computing the company (if included in the allowed ones)
-            # for avoiding multi company incompatibility errors:
-            # - If this call is done from method _check_company, the company of the
-            #   record to be compared.
-            # - Otherwise, current company of the user.
-            company_id = (
-                self.env.context.get("_check_company_source_id")
-                or self.env.context.get("force_company")
-                or self.env.company.id
-            )
-            if company_id in record.company_ids.ids:
-                record.company_id = company_id
-            else:
-                record.company_id = record.company_ids[:1].id
+            company_ids = record.company_ids._ids
+            if company_ids not in resolved:
+                if company_id in company_ids:
+                    resolved[company_ids] = company_id
+                else:
+                    resolved[company_ids] = company_ids[0] if company_ids else False
+            groups[resolved[company_ids]].append(record.id)
+        for record_company_id, record_ids in groups.items():
+            self.browse(record_ids).company_id = record_company_id
 
     def _inverse_company_id(self):
         # To allow modifying allowed companies by non-aware base_multi_company
         # through company_id field we:
         # - Remove all companies, then add the provided one
+        # Records are grouped by company for rewriting the relation once per
+        # company instead of once per record. Records already having only that
+        # company, as when `write` has given company_ids, are skipped.
+        groups = defaultdict(list)
         for record in self:
-            record.company_ids = [(6, 0, record.company_id.ids)]
+            company_id = record.company_id.id
+            if record.company_ids._ids != ((company_id,) if company_id else ()):
+                groups[company_id].append(record.id)
+        for company_id, record_ids in groups.items():
+            self.browse(record_ids).company_ids = [
+                (6, 0, [company_id] if company_id else [])
+            ]
 
     def _search_company_id(self, operator, value):
         return [("company_ids", operator, value)]
@@ -73,61 +280,240 @@ class MultiCompanyAbstract(models.AbstractModel):
         for vals in vals_list:
             if "company_ids" in vals and "company_id" in vals:
                 del vals["company_id"]
-        return super().create(vals_list)
+        records = super().create(vals_list)
+        if self._company_ids_array or self._company_set:
+            records.flush(["company_ids"])
+            records._sync_company_ids_storage()
+        return records
 
     def write(self, vals):
-        """Discard changes in company_id field if company_ids has been given."""
+        """Discard changes in company_id field if company_ids has been given.
+
+        When only company_id is given, it is the same company for all the
+        records, so it is also written as company_ids in a single relation
+        rewrite, leaving nothing to do to the inverse.
+        """
         if "company_ids" in vals and "company_id" in vals:
             del vals["company_id"]
-        return super().write(vals)
+        elif "company_id" in vals:
+            company_id = vals["company_id"]
+            if isinstance(company_id, models.BaseModel):
+                company_id = company_id.id
+            vals = dict(vals, company_ids=[(6, 0, [company_id] if company_id else [])])
+        res = super().write(vals)
+        if (self._company_ids_array or self._company_set) and "company_ids" in vals:
+            self.flush(["company_ids"])
+            self._sync_company_ids_storage()
+        return res
+
+    def share_companies(self, company_ids, domain=None):
+        """Add the given companies to `company_ids` of these records, or of the
+        records matching `domain` if given, with set-based SQL.
+
+        :param company_ids: list of `res.company` ids to add.
+        :param domain: optional search domain replacing the records of `self`.
+        :return: the records whose companies have changed.
+        """
+        return self._update_company_ids("share", company_ids, domain)
+
+    def unshare_companies(self, company_ids, domain=None):
+        """Remove the given companies from `company_ids` of these records, or
+        of the records matching `domain` if given, with set-based SQL.
+
+        :param company_ids: list of `res.company` ids to remove.
+        :param domain: optional search domain replacing the records of `self`.
+        :return: the records whose companies have changed.
+        """
+        return self._update_company_ids("unshare", company_ids, domain)
+
+    def _get_company_ids_target_query(self, domain):
+        """Return the query selecting the ids of the records to update, with
+        the write record rules applied.
+        """
+        self.check_access_rights("write")
+        if domain is None:
+            self.check_access_rule("write")
+            return "SELECT unnest(%s::int4[])", [self.ids]
+        # The target is read with SQL, write the pending changes of the
+        # fields of the domain first
+        self._flush_search(domain)
+        query = self._where_calc(domain)
+        self._apply_ir_rules(query, "write")
+        return query.select('"{}".id'.format(self._table))
+
+    def _update_company_ids(self, mode, company_ids, domain=None):
+        company_ids = [company_id for company_id in company_ids if company_id]
+        if not company_ids or (domain is None and not self):
+            return self.browse()
+        # The statement reads the relation table and no_company_ids with SQL
+        self.flush(["company_ids", "no_company_ids"])
+        target_query, target_params = self._get_company_ids_target_query(domain)
+        field = self._fields["company_ids"]
+        names = {
+            "table": self._table,
+            "relation": field.relation,
+            "column1": field.column1,
+            "column2": field.column2,
+            "target": target_query,
+        }
+        # All the parts of the statement see the relation table as it was
+        # before it, so no_company_ids is deduced from the removed companies
+        if mode == "share":
+            query = """
+                WITH changed AS (
+                    INSERT INTO "{relation}" ("{column1}", "{column2}")
+                    SELECT t.id, c.id FROM ({target}) AS t(id)
+                    CROSS JOIN unnest(%s::int4[]) AS c(id)
+                    ON CONFLICT DO NOTHING
+                    RETURNING "{column1}" AS id
+                ), updated AS (
+                    UPDATE "{table}" t SET {set_clause}
+                    WHERE t.id IN (SELECT id FROM changed)
+                )
+                SELECT DISTINCT id FROM changed
+            """
+            if self._company_ids_array:
+                set_clause = """
+                    no_company_ids = FALSE,
+                    company_ids_array = ARRAY(
+                        SELECT DISTINCT x
+                        FROM unnest(t.company_ids_array || %s::int4[]) AS x
+                        ORDER BY x
+                    )
+                """
+            else:
+                set_clause = "no_company_ids = FALSE"
+        else:
+            query = """
+                WITH changed AS (
+                    DELETE FROM "{relation}"
+                    WHERE "{column1}" IN ({target})
+                        AND "{column2}" = ANY(%s::int4[])
+                    RETURNING "{column1}" AS id
+                ), updated AS (
+                    UPDATE "{table}" t SET {set_clause}
+                    WHERE t.id IN (SELECT id FROM changed)
+                )
+                SELECT DISTINCT id FROM changed
+            """
+            if self._company_ids_array:
+                set_clause = """
+                    no_company_ids = t.company_ids_array <@ %s::int4[],
+                    company_ids_array = ARRAY(
+                        SELECT x FROM unnest(t.company_ids_array) AS x
+                        WHERE x <> ALL(%s::int4[])
+                        ORDER BY x
+                    )
+                """
+            else:
+                set_clause = """
+                    no_company_ids = NOT EXISTS (
+                        SELECT 1 FROM "{relation}" r
+                        WHERE r."{column1}" = t.id
+                            AND r."{column2}" <> ALL(%s::int4[])
+                    )
+                """.format(
+                    **names
+                )
+        params = target_params + [company_ids]
+        params += [company_ids] * set_clause.count("%s")
+        self.env.cr.execute(query.format(set_clause=set_clause, **names), params)
+        records = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if records and self._company_set:
+            records._sync_company_set()
+        if records:
+            # Invalidate the cache and trigger the recomputation of the fields
+            # depending on company_ids, except no_company_ids, already updated
+            self.invalidate_cache(["company_ids", "no_company_ids"], records.ids)
+            records.modified(["company_ids"])
+            self.env.remove_to_compute(self._fields["no_company_ids"], records)
+        return records
 
     @api.model
     def _patch_company_domain(self, args):
-        # In some situations the 'in' operator is used with company_id in a
-        # name_search or search_read. ORM does not convert to a proper WHERE clause when using
-        # the 'in' operator.
+        # The ORM translates ('company_id', 'in', [False, 1]) into a broken
+        # WHERE clause on the relation table:
         # e.g: ```
         #     WHERE "res_partner"."id" in (SELECT "res_partner_id"
         #     FROM "res_company_res_partner_rel" WHERE "res_company_id" IN (False, 1)
         # ```
-        # patching the args to expand the cumbersome args int a OR clause fix
-        # the issue.
+        # Expanding the list into a chain of OR leaves fixes it, but produces one
+        # subquery per company. Instead, replace `in`/`not in` leaves on
+        # `company_id`/`company_ids` with a single lookup of the relation table,
+        # whatever the size of the list, and the records without companies with
+        # the indexed `no_company_ids` column:
         # e.g: ```
-        #     WHERE "res_partner"."id" not in (SELECT "res_partner_id"
-        #             FROM "res_company_res_partner_rel"
-        #             where "res_partner_id" is not null)
-        #         OR  ("res_partner"."id" in (SELECT "res_partner_id"
-        #             FROM "res_company_res_partner_rel" WHERE "res_company_id" IN 1)
+        #     WHERE ("res_partner"."id" in (SELECT "res_partner_id"
+        #         FROM "res_company_res_partner_rel" WHERE "res_company_id" IN (1))
+        #         OR "res_partner"."no_company_ids" = true)
         # ```
         new_args = []
         if args is None:
             args = []
         for arg in args:
-            if type(arg) == list and arg[:2] == ["company_id", "in"]:
-                fix = []
-                for _i in range(len(arg[2]) - 1):
-                    fix.append("|")
-                for val in arg[2]:
-                    fix.append(["company_id", "=", val])
-                new_args.extend(fix)
-            else:
-                new_args.append(arg)
+            if (
+                isinstance(arg, (list, tuple))
+                and len(arg) == 3
+                and arg[0] in ("company_id", "company_ids")
+            ):
+                if arg[1] in ("in", "not in"):
+                    new_args += self._get_company_ids_domain(arg[1], arg[2])
+                    continue
+                if arg[1] in ("=", "!=") and arg[2] is False:
+                    new_args.append(("no_company_ids", "=", arg[1] == "="))
+                    continue
+            new_args.append(arg)
+        if new_args != list(args):
+            # The search only flushed the fields of the original domain
+            self.flush(["company_ids", "no_company_ids"])
         return new_args
 
     @api.model
-    def _name_search(
-        self, name, args=None, operator="ilike", limit=100, name_get_uid=None
-    ):
-        new_args = self._patch_company_domain(args)
-        return super()._name_search(
-            name,
-            args=new_args,
-            operator=operator,
-            limit=limit,
-            name_get_uid=name_get_uid,
-        )
+    def _get_company_ids_domain(self, operator, value):
+        """Return a domain equivalent to `('company_ids', operator, value)`,
+        where `operator` is `in` or `not in` and `value` may contain `False`
+        for matching the records without companies.
+        """
+        if isinstance(value, int):
+            value = [value]
+        company_ids = tuple(company_id for company_id in value if company_id)
+        with_no_company = len(company_ids) != len(value)
+        positive = operator == "in"
+        if not company_ids and not with_no_company:
+            return [FALSE_LEAF if positive else TRUE_LEAF]
+        domains = []
+        if self._company_set:
+            set_ids = self.env["multi.company.set"]._get_set_ids(
+                company_ids, include_empty=with_no_company
+            )
+            return [("company_set_id", operator, list(set_ids))]
+        if company_ids:
+            if self._company_ids_array:
+                query = (
+                    'SELECT id FROM "{}" WHERE company_ids_array && %s::int4[]'.format(
+                        self._table
+                    )
+                )
+                params = [list(company_ids)]
+            else:
+                field = self._fields["company_ids"]
+                query = 'SELECT "{column1}" FROM "{relation}" WHERE "{column2}" IN %s'.format(
+                    relation=field.relation,
+                    column1=field.column1,
+                    column2=field.column2,
+                )
+                params = [company_ids]
+            domains.append(
+                [("id", "inselect" if positive else "not inselect", (query, params))]
+            )
+        if with_no_company:
+            domains.append([("no_company_ids", "=", positive)])
+        return expression.OR(domains) if positive else expression.AND(domains)
 
     @api.model
-    def search_read(self, domain=None, fields=None, offset=0, limit=None, order=None):
-        new_domain = self._patch_company_domain(domain)
-        return super().search_read(new_domain, fields, offset, limit, order)
+    def _where_calc(self, domain, active_test=True):
+        # Entry point shared by search, search_count, search_read, name_search
+        # and read_group
+        return super()._where_calc(
+            self._patch_company_domain(domain), active_test=active_test
+        )
@@ -0,0 +1,115 @@
+# License LGPL-3.0 or later (http://www.gnu.org/licenses/lgpl.html).
+
+from odoo import api, fields, models, tools
+
+
+class MultiCompanySet(models.Model):
+    """Distinct combination of companies shared by multi-company records.
+
+    Filled with SQL by the models inheriting `multi.company.abstract` with
+    `_company_set` enabled, one record per different value of their
+    `company_ids`.
+    """
+
+    _name = "multi.company.set"
+    _description = "Multi-Company Set"
+    _log_access = False
+
+    key = fields.Char(
+        required=True,
+        readonly=True,
+        help="Comma-separated sorted ids of the companies of the set",
+    )
+    company_ids = fields.Many2many(
+        string="Companies",
+        comodel_name="res.company",
+        relation="multi_company_set_res_company_rel",
+        column1="set_id",
+        column2="company_id",
+        readonly=True,
+    )
+
+    _sql_constraints = [
+        ("key_uniq", "unique(key)", "A company set must be unique."),
+    ]
+
+    @api.model
+    def _get_set_ids(self, company_ids, include_empty=False):
+        """Return the ids of the sets visible by the given companies, i.e. the
+        sets sharing at least one company with them, plus the set without any
+        company if `include_empty` is set.
+        """
+        return self._get_set_ids_cached(
+            tuple(sorted(set(company_ids))), bool(include_empty)
+        )
+
+    @tools.ormcache("company_ids", "include_empty")
+    def _get_set_ids_cached(self, company_ids, include_empty):
+        self.env.cr.execute(
+            """
+            SELECT s.id FROM multi_company_set s
+            WHERE (%s AND s.key = '') OR EXISTS (
+                SELECT 1 FROM multi_company_set_res_company_rel r
+                WHERE r.set_id = s.id AND r.company_id IN %s
+            )
+            ORDER BY s.id
+            """,
+            (include_empty, company_ids or (None,)),
+        )
+        return tuple(row[0] for row in self.env.cr.fetchall())
+
+    @api.model
+    def _sync_records(self, model, where, params):
+        """Create the sets missing for the records of `model` matched by the
+        `where` clause on `t2`, and link the records to their set.
+        """
+        cr = self.env.cr
+        field = model._fields["company_ids"]
+        keys_query = """
+            SELECT t2.id, array_to_string(ARRAY(
+                SELECT r."{column2}" FROM "{relation}" r
+                WHERE r."{column1}" = t2.id ORDER BY r."{column2}"
+            ), ',') AS key
+            FROM "{table}" t2
+            {where}
+        """.format(
+            table=model._table,
+            relation=field.relation,
+            column1=field.column1,
+            column2=field.column2,
+            where=where,
+        )
+        cr.execute(
+            """
+            INSERT INTO multi_company_set (key)
+            SELECT DISTINCT keys.key FROM ({}) keys
+            ON CONFLICT (key) DO NOTHING
+            RETURNING id
+            """.format(
+                keys_query
+            ),
+            params,
+        )
+        new_set_ids = [row[0] for row in cr.fetchall()]
+        if new_set_ids:
+            cr.execute(
+                """
+                INSERT INTO multi_company_set_res_company_rel (set_id, company_id)
+                SELECT s.id, unnest(string_to_array(s.key, ',')::int4[])
+                FROM multi_company_set s
+                WHERE s.id IN %s
+                """,
+                (tuple(new_set_ids),),
+            )
+            self.clear_caches()
+        cr.execute(
+            """
+            UPDATE "{table}" t SET company_set_id = s.id
+            FROM ({keys_query}) keys
+            JOIN multi_company_set s ON s.key = keys.key
+            WHERE t.id = keys.id AND t.company_set_id IS DISTINCT FROM s.id
+            """.format(
+                table=model._table, keys_query=keys_query
+            ),
+            params,
+        )
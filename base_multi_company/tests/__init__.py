@@ -1,2 +1,4 @@
 # License LGPL-3 - See http://www.gnu.org/licenses/lgpl-3.0.html
 from . import test_multi_company_abstract
+from . import test_check_company_benchmark
+from . import test_rule_benchmark
@@ -10,3 +10,33 @@ class MultiCompanyAbstractTester(models.Model):
     _description = "Multi Company Abstract Tester"
 
     name = fields.Char()
+
+
+class MultiCompanyAbstractArrayTester(models.Model):
+    _name = "multi.company.abstract.array.tester"
+    _inherit = "multi.company.abstract"
+    _description = "Multi Company Abstract Array Tester"
+    _company_ids_array = True
+
+    name = fields.Char()
+
+
+class MultiCompanyAbstractSetTester(models.Model):
+    _name = "multi.company.abstract.set.tester"
+    _inherit = "multi.company.abstract"
+    _description = "Multi Company Abstract Set Tester"
+    _company_set = True
+
+    name = fields.Char()
+
+
+class MultiCompanyAbstractTesterLine(models.Model):
+    _name = "multi.company.abstract.tester.line"
+    _description = "Multi Company Abstract Tester Line"
+    _check_company_auto = True
+
+    name = fields.Char()
+    company_id = fields.Many2one(comodel_name="res.company")
+    tester_id = fields.Many2one(
+        comodel_name="multi.company.abstract.tester", check_company=True
+    )
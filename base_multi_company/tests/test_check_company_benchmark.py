@@ -0,0 +1,109 @@
+# License LGPL-3 - See http://www.gnu.org/licenses/lgpl-3.0.html
+
+import logging
+import time
+
+from odoo_test_helper import FakeModelLoader
+
+from odoo import models
+from odoo.tests import common, tagged
+
+_logger = logging.getLogger(__name__)
+
+
+@tagged("-standard", "base_multi_company_benchmark")
+class TestCheckCompanyBenchmark(common.SavepointCase):
+    """Compare the company-grouped ``_check_company`` with the original
+    implementation, which switched the context and called super on the whole
+    recordset once per record.
+
+    Not run by default. Launch it explicitly with::
+
+        odoo -d <db> -i base_multi_company --test-tags base_multi_company_benchmark
+    """
+
+    # The original implementation is quadratic, keep the dataset small
+    records_per_company = 250
+    company_count = 4
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.loader = FakeModelLoader(cls.env, cls.__module__)
+        cls.loader.backup_registry()
+        from .multi_company_abstract_tester import (
+            MultiCompanyAbstractTester,
+            MultiCompanyAbstractTesterLine,
+        )
+
+        cls.loader.update_registry(
+            (MultiCompanyAbstractTester, MultiCompanyAbstractTesterLine)
+        )
+        cls.companies = cls.env.company
+        for i in range(cls.company_count - 1):
+            cls.companies |= cls.env["res.company"].create(
+                {"name": "Benchmark Co %s" % i}
+            )
+        cls.tester = cls.env["multi.company.abstract.tester"].create(
+            {"name": "shared", "company_ids": [(6, 0, cls.companies.ids)]}
+        )
+        vals_list = []
+        for company in cls.companies:
+            vals_list += [
+                {
+                    "name": "line %s" % i,
+                    "company_id": company.id,
+                    "tester_id": cls.tester.id,
+                }
+                for i in range(cls.records_per_company)
+            ]
+        cls.lines = cls.env["multi.company.abstract.tester.line"].create(vals_list)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loader.restore_registry()
+        super().tearDownClass()
+
+    def _measure(self, func):
+        self.lines.invalidate_cache()
+        count = self.env.cr.sql_log_count
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start, self.env.cr.sql_log_count - count
+
+    def _check_original(self):
+        """Original ``Base._check_company`` of this module, calling directly the
+        implementation of the ORM as its super.
+        """
+        records = self.lines
+        for record in records:
+            company_source_id = False
+            if record._name == "res.company":
+                company_source_id = records.id
+            elif "company_id" in record._fields:
+                company_source_id = record.company_id.id
+            records = records.with_context(_check_company_source_id=company_source_id)
+            models.BaseModel._check_company(records)
+
+    def _check_grouped(self):
+        """Current ``Base._check_company``, with the same direct call to the
+        implementation of the ORM.
+        """
+        for company_source_id, records in self.lines._group_by_check_company_source():
+            records = records.with_context(_check_company_source_id=company_source_id)
+            models.BaseModel._check_company(records)
+
+    def test_check_company_benchmark(self):
+        original_time, original_queries = self._measure(self._check_original)
+        grouped_time, grouped_queries = self._measure(self._check_grouped)
+        _logger.info(
+            "_check_company on %s records / %s companies: "
+            "original %.3fs (%s queries), grouped %.3fs (%s queries)",
+            len(self.lines),
+            len(self.companies),
+            original_time,
+            original_queries,
+            grouped_time,
+            grouped_queries,
+        )
+        self.assertLessEqual(grouped_queries, original_queries)
@@ -2,9 +2,15 @@
 # Copyright 2021 ACSONE SA/NV
 # License LGPL-3 - See http://www.gnu.org/licenses/lgpl-3.0.html
 
+from unittest import mock
+
 from odoo_test_helper import FakeModelLoader
 
+from odoo.osv.expression import FALSE_LEAF
 from odoo.tests import common
+from odoo.tools import sql
+
+from .. import hooks
 
 
 class TestMultiCompanyAbstract(common.SavepointCase):
@@ -15,27 +21,46 @@ class TestMultiCompanyAbstract(common.SavepointCase):
         cls.loader.backup_registry()
 
         # The fake class is imported here !! After the backup_registry
-        from .multi_company_abstract_tester import MultiCompanyAbstractTester
+        from .multi_company_abstract_tester import (
+            MultiCompanyAbstractArrayTester,
+            MultiCompanyAbstractSetTester,
+            MultiCompanyAbstractTester,
+        )
 
-        cls.loader.update_registry((MultiCompanyAbstractTester,))
+        cls.loader.update_registry(
+            (
+                MultiCompanyAbstractTester,
+                MultiCompanyAbstractArrayTester,
+                MultiCompanyAbstractSetTester,
+            )
+        )
 
         cls.test_model = cls.env["multi.company.abstract.tester"]
+        cls.array_test_model = cls.env["multi.company.abstract.array.tester"]
+        cls.set_test_model = cls.env["multi.company.abstract.set.tester"]
 
         cls.tester_model = cls.env["ir.model"].search(
             [("model", "=", "multi.company.abstract.tester")]
         )
+        cls.array_tester_model = cls.env["ir.model"].search(
+            [("model", "=", "multi.company.abstract.array.tester")]
+        )
+        cls.set_tester_model = cls.env["ir.model"].search(
+            [("model", "=", "multi.company.abstract.set.tester")]
+        )
 
         # Access record:
-        cls.env["ir.model.access"].create(
-            {
-                "name": "access.tester",
-                "model_id": cls.tester_model.id,
-                "perm_read": 1,
-                "perm_write": 1,
-                "perm_create": 1,
-                "perm_unlink": 1,
-            }
-        )
+        for model in cls.tester_model + cls.array_tester_model + cls.set_tester_model:
+            cls.env["ir.model.access"].create(
+                {
+                    "name": "access.%s" % model.model,
+                    "model_id": model.id,
+                    "perm_read": 1,
+                    "perm_write": 1,
+                    "perm_create": 1,
+                    "perm_unlink": 1,
+                }
+            )
 
         cls.record_1 = cls.test_model.create({"name": "test"})
         cls.company_1 = cls.env.company
@@ -115,11 +140,69 @@ class TestMultiCompanyAbstract(common.SavepointCase):
         new_domain = self.test_model._patch_company_domain(
             [["company_id", "in", [False, self.company_2.id]]]
         )
+        self.assertEqual(new_domain[0], "|")
+        self.assertEqual(new_domain[1][:2], ("id", "inselect"))
         self.assertEqual(
-            ["|", ["company_id", "=", False], ["company_id", "=", self.company_2.id]],
-            new_domain,
+            new_domain[1][2][0],
+            'SELECT "{column1}" FROM "{relation}" WHERE "{column2}" IN %s'.format(
+                column1=self.test_model._fields["company_ids"].column1,
+                column2=self.test_model._fields["company_ids"].column2,
+                relation=self.test_model._fields["company_ids"].relation,
+            ),
+        )
+        self.assertEqual(new_domain[2], ("no_company_ids", "=", True))
+        self.assertEqual(
+            self.test_model._patch_company_domain(
+                [("company_ids", "not in", [False, self.company_2.id])]
+            )[2],
+            ("no_company_ids", "=", False),
+        )
+        self.assertEqual(
+            self.test_model._patch_company_domain([("company_id", "=", False)]),
+            [("no_company_ids", "=", True)],
+        )
+        self.assertEqual(
+            self.test_model._patch_company_domain([("company_ids", "in", [])]),
+            [FALSE_LEAF],
         )
 
+    def test_search_company_id_in(self):
+        """`in`/`not in` on company_id(s) handle False and big lists."""
+        record_2 = self.test_model.create(
+            {"name": "test 2", "company_ids": [(6, 0, self.company_2.ids)]}
+        )
+        records = self.record_1 + record_2
+        domain = [("id", "in", records.ids)]
+        company_ids = list(range(1000000, 1000060)) + self.company_2.ids
+        for field_name in ("company_id", "company_ids"):
+            self.assertEqual(
+                self.test_model.search(domain + [(field_name, "in", company_ids)]),
+                record_2,
+            )
+            self.assertEqual(
+                self.test_model.search(domain + [(field_name, "in", [False])]),
+                self.record_1,
+            )
+            self.assertEqual(
+                self.test_model.search(
+                    domain + [(field_name, "not in", [False, self.company_2.id])]
+                ),
+                self.test_model,
+            )
+            self.assertEqual(
+                self.test_model.search(domain + [(field_name, "not in", [])]),
+                records,
+            )
+        self.assertEqual(
+            self.test_model.search_count(domain + [("company_id", "in", [False])]), 1
+        )
+        groups = self.test_model.read_group(
+            domain + [("company_id", "in", [False, self.company_2.id])],
+            ["name"],
+            ["name"],
+        )
+        self.assertEqual(len(groups), 2)
+
     def test_compute_company_id2(self):
         """
         Test the computation of company_id for a multi_company_abstract.
@@ -280,3 +363,238 @@ class TestMultiCompanyAbstract(common.SavepointCase):
         tester.company_id = False
 
         self.assertFalse(tester.sudo().company_ids)
+
+    def _get_company_ids_array(self, record):
+        record.flush()
+        self.env.cr.execute(
+            "SELECT company_ids_array FROM {} WHERE id = %s".format(record._table),
+            (record.id,),
+        )
+        return self.env.cr.fetchone()[0]
+
+    def test_company_ids_array_sync(self):
+        companies = self.company_1 + self.company_2
+        tester = self.array_test_model.create(
+            {"name": "array", "company_ids": [(6, 0, companies.ids)]}
+        )
+        self.assertEqual(self._get_company_ids_array(tester), sorted(companies.ids))
+        tester.company_ids = [(3, self.company_1.id)]
+        self.assertEqual(self._get_company_ids_array(tester), self.company_2.ids)
+        tester.company_id = False
+        self.assertEqual(self._get_company_ids_array(tester), [])
+        self.assertTrue(tester.no_company_ids)
+
+    def test_search_company_ids_match(self):
+        tester_none = self.array_test_model.create({"name": "none"})
+        tester_2 = self.array_test_model.create(
+            {"name": "two", "company_ids": [(6, 0, self.company_2.ids)]}
+        )
+        tester_1 = self.array_test_model.create(
+            {"name": "one", "company_ids": [(6, 0, self.company_1.ids)]}
+        )
+        testers = tester_none + tester_1 + tester_2
+        domain = [("id", "in", testers.ids)]
+        self.assertEqual(
+            self.array_test_model.search(
+                domain + [("company_ids_match", "in", self.company_2.ids)]
+            ),
+            tester_none + tester_2,
+        )
+        self.assertEqual(
+            self.array_test_model.search(domain + [("company_ids_match", "in", [])]),
+            tester_none,
+        )
+        # Same results without the array column
+        self.assertEqual(
+            self.test_model.search(
+                [
+                    ("id", "=", self.record_1.id),
+                    ("company_ids_match", "in", self.company_2.ids),
+                ]
+            ),
+            self.record_1,
+        )
+
+    def test_compute_company_id_batch(self):
+        """company_id is resolved per record when computed on a recordset."""
+        company_3 = self.env["res.company"].create({"name": "Test Co 3"})
+        self.env.user.company_ids |= self.company_2 + company_3
+        testers = self.test_model.create(
+            [
+                {
+                    "name": "1-2",
+                    "company_ids": [(6, 0, (self.company_1 + self.company_2).ids)],
+                },
+                {
+                    "name": "2-3",
+                    "company_ids": [(6, 0, (self.company_2 + company_3).ids)],
+                },
+                {"name": "3", "company_ids": [(6, 0, company_3.ids)]},
+                {"name": "none"},
+            ]
+        )
+        testers.invalidate_cache()
+        self.assertEqual(
+            testers.with_company(self.company_2).mapped("company_id"),
+            self.company_2 + company_3,
+        )
+        self.assertEqual(
+            [t.company_id.id for t in testers.with_company(self.company_1)],
+            [self.company_1.id, self.company_2.id, company_3.id, False],
+        )
+
+    def test_share_unshare_companies(self):
+        for model in (self.test_model, self.array_test_model, self.set_test_model):
+            testers = model.create(
+                [
+                    {"name": "share 1"},
+                    {"name": "share 2", "company_ids": [(6, 0, self.company_1.ids)]},
+                ]
+            )
+            changed = testers.share_companies(self.company_2.ids)
+            self.assertEqual(changed, testers)
+            self.assertEqual(testers[0].company_ids, self.company_2)
+            self.assertEqual(testers[1].company_ids, self.company_1 + self.company_2)
+            self.assertFalse(any(testers.mapped("no_company_ids")))
+            # Already shared
+            self.assertFalse(testers.share_companies(self.company_2.ids))
+            changed = model.unshare_companies(
+                self.company_2.ids, domain=[("id", "in", testers.ids)]
+            )
+            self.assertEqual(changed, testers)
+            self.assertFalse(testers[0].company_ids)
+            self.assertTrue(testers[0].no_company_ids)
+            self.assertEqual(testers[1].company_ids, self.company_1)
+            self.assertFalse(testers[1].no_company_ids)
+            self.assertEqual(
+                model.search(
+                    [("id", "in", testers.ids), ("company_id", "in", [False])]
+                ),
+                testers[0],
+            )
+
+    def test_share_companies_pending_changes(self):
+        tester = self.test_model.create({"name": "pending"})
+        # Changes not written to the database yet are seen by the domain
+        tester.name = "pending renamed"
+        changed = self.test_model.share_companies(
+            self.company_2.ids,
+            domain=[("name", "=", "pending renamed"), ("no_company_ids", "=", True)],
+        )
+        self.assertEqual(changed, tester)
+        self.assertEqual(tester.company_ids, self.company_2)
+
+    def test_write_company_id_batch(self):
+        testers = self.test_model.create(
+            [
+                {"name": "a", "company_ids": [(6, 0, self.company_1.ids)]},
+                {
+                    "name": "b",
+                    "company_ids": [(6, 0, (self.company_1 + self.company_2).ids)],
+                },
+            ]
+        )
+        testers.write({"company_id": self.company_2.id})
+        for tester in testers:
+            self.assertEqual(tester.company_ids, self.company_2)
+        testers.write({"company_id": False})
+        self.assertFalse(testers.mapped("company_ids"))
+        self.assertTrue(all(testers.mapped("no_company_ids")))
+
+    def test_fill_company_ids_resume(self):
+        model = self.test_model
+        self.env.cr.execute(
+            'ALTER TABLE "{}" ADD COLUMN company_id int4'.format(model._table)
+        )
+        testers = model.create([{"name": "fill %s" % i} for i in range(5)])
+        testers.flush()
+        self.env.cr.execute(
+            'UPDATE "{}" SET company_id = %s WHERE id IN %s'.format(model._table),
+            (self.company_2.id, tuple(testers.ids)),
+        )
+        config = self.env["ir.config_parameter"].sudo()
+        progress_key = "base_multi_company.backfill.%s" % model._name
+        # An interrupted run committed the ids before the fourth tester
+        config.set_param(progress_key + ".company_ids", testers[3].id)
+        with mock.patch.object(self.env.cr, "commit") as commit:
+            hooks.fill_company_ids(self.env, model._name, batch_size=2, commit=True)
+        self.assertTrue(commit.called)
+        self.assertFalse(testers[:3].mapped("company_ids"))
+        self.assertTrue(all(testers[:3].mapped("no_company_ids")))
+        for tester in testers[3:]:
+            self.assertEqual(tester.company_ids, self.company_2)
+            self.assertFalse(tester.no_company_ids)
+        # The progress is kept until the whole backfill succeeds
+        self.assertFalse(config.get_param(progress_key + ".company_ids"))
+        self.assertFalse(config.get_param(progress_key + ".no_company_ids"))
+        # A finished step is not run again
+        max_id = max(model.search([]).ids)
+        config.set_param(progress_key + ".company_ids", max_id + 1)
+        with mock.patch.object(self.env.cr, "commit"):
+            hooks.fill_company_ids(self.env, model._name, batch_size=2, commit=True)
+        self.assertFalse(testers[:3].mapped("company_ids"))
+        with mock.patch.object(self.env.cr, "commit"):
+            hooks.fill_company_ids(self.env, model._name, batch_size=2, commit=True)
+        self.assertEqual(testers[0].company_ids, self.company_2)
+
+    def _get_company_set(self, record):
+        record.flush()
+        self.env.cr.execute(
+            "SELECT company_set_id FROM {} WHERE id = %s".format(record._table),
+            (record.id,),
+        )
+        return self.env["multi.company.set"].browse(self.env.cr.fetchone()[0])
+
+    def test_company_set_field(self):
+        self.assertIn("company_set_id", self.set_test_model._fields)
+        for model in (self.test_model, self.array_test_model):
+            self.assertNotIn("company_set_id", model._fields)
+            self.assertFalse(
+                sql.column_exists(self.env.cr, model._table, "company_set_id")
+            )
+
+    def test_company_set(self):
+        companies = self.company_1 + self.company_2
+        testers = self.set_test_model.create(
+            [
+                {"name": "both", "company_ids": [(6, 0, companies.ids)]},
+                {"name": "both again", "company_ids": [(6, 0, companies.ids)]},
+                {"name": "one", "company_ids": [(6, 0, self.company_1.ids)]},
+                {"name": "none"},
+            ]
+        )
+        company_set = self._get_company_set(testers[0])
+        self.assertEqual(company_set.company_ids, companies)
+        self.assertEqual(self._get_company_set(testers[1]), company_set)
+        self.assertEqual(self._get_company_set(testers[2]).company_ids, self.company_1)
+        self.assertFalse(self._get_company_set(testers[3]).company_ids)
+        domain = [("id", "in", testers.ids)]
+        self.assertEqual(
+            self.set_test_model.search(
+                domain + [("company_ids_match", "in", self.company_2.ids)]
+            ),
+            testers[0] + testers[1] + testers[3],
+        )
+        self.assertEqual(
+            self.set_test_model.search(
+                domain + [("company_id", "in", self.company_1.ids)]
+            ),
+            testers[:3],
+        )
+        testers[2].company_ids = [(4, self.company_2.id)]
+        self.assertEqual(self._get_company_set(testers[2]), company_set)
+        self.assertEqual(testers[2].company_set_id, company_set)
+        self.assertEqual(
+            self.set_test_model._patch_company_domain(
+                [("company_ids", "not in", self.company_2.ids)]
+            ),
+            [
+                (
+                    "company_set_id",
+                    "not in",
+                    list(
+                        self.env["multi.company.set"]._get_set_ids(self.company_2.ids)
+                    ),
+                )
+            ],
+        )
@@ -0,0 +1,193 @@
+# License LGPL-3 - See http://www.gnu.org/licenses/lgpl-3.0.html
+
+import logging
+import os
+import random
+import time
+
+from odoo_test_helper import FakeModelLoader
+
+from odoo.tests import common, tagged
+
+from ..hooks import get_security_rule_domain
+
+_logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    return int(os.environ.get("BASE_MULTI_COMPANY_BENCHMARK_%s" % name, default))
+
+
+def _percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(ratio * (len(values) - 1))))]
+
+
+@tagged("-standard", "base_multi_company_benchmark")
+class TestRuleBenchmark(common.SavepointCase):
+    """Measure the multi-company record rule on the usual read operations.
+
+    Not run by default. Launch it explicitly against a test database with::
+
+        odoo -d <db> -i base_multi_company --test-tags base_multi_company_benchmark
+
+    The dataset is tuned with these environment variables (prefixed by
+    ``BASE_MULTI_COMPANY_BENCHMARK_``):
+
+    * ``COMPANIES``: number of companies (default 10).
+    * ``RECORDS``: number of records per storage mode (default 10000).
+    * ``SHARED_PERCENT``: percentage of records shared with several companies
+      (default 30), the others belonging to a single company.
+    * ``NO_COMPANY_PERCENT``: percentage of records without company
+      (default 5).
+    * ``ALLOWED_COMPANIES``: number of companies allowed to the user
+      (default 3).
+    * ``REPEAT``: number of runs of each operation (default 20).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.loader = FakeModelLoader(cls.env, cls.__module__)
+        cls.loader.backup_registry()
+        from .multi_company_abstract_tester import (
+            MultiCompanyAbstractArrayTester,
+            MultiCompanyAbstractSetTester,
+            MultiCompanyAbstractTester,
+        )
+
+        cls.loader.update_registry(
+            (
+                MultiCompanyAbstractTester,
+                MultiCompanyAbstractArrayTester,
+                MultiCompanyAbstractSetTester,
+            )
+        )
+        cls.repeat = _env_int("REPEAT", 20)
+        rand = random.Random(42)
+        company_count = _env_int("COMPANIES", 10)
+        cls.companies = cls.env["res.company"].create(
+            [{"name": "Benchmark Co %s" % i} for i in range(company_count)]
+        )
+        allowed_companies = cls.companies[: _env_int("ALLOWED_COMPANIES", 3)]
+        cls.user = cls.env["res.users"].create(
+            {
+                "name": "Benchmark user",
+                "login": "base_multi_company_benchmark",
+                "groups_id": [(6, 0, cls.env.ref("base.group_user").ids)],
+                "company_id": allowed_companies[0].id,
+                "company_ids": [(6, 0, allowed_companies.ids)],
+            }
+        )
+        cls.allowed_company_ids = allowed_companies.ids
+        record_count = _env_int("RECORDS", 10000)
+        shared_percent = _env_int("SHARED_PERCENT", 30)
+        no_company_percent = _env_int("NO_COMPANY_PERCENT", 5)
+        company_ids_list = []
+        for _i in range(record_count):
+            draw = rand.randrange(100)
+            if draw < no_company_percent:
+                company_ids_list.append([])
+            elif draw < no_company_percent + shared_percent:
+                company_ids_list.append(
+                    rand.sample(cls.companies.ids, rand.randint(2, company_count))
+                )
+            else:
+                company_ids_list.append([rand.choice(cls.companies.ids)])
+        cls.models = []
+        for model_name in (
+            "multi.company.abstract.tester",
+            "multi.company.abstract.array.tester",
+            "multi.company.abstract.set.tester",
+        ):
+            model = cls.env[model_name]
+            ir_model = cls.env["ir.model"]._get(model_name)
+            cls.env["ir.model.access"].create(
+                {
+                    "name": "access.benchmark.%s" % model_name,
+                    "model_id": ir_model.id,
+                    "perm_read": 1,
+                }
+            )
+            cls.env["ir.rule"].create(
+                {
+                    "name": "benchmark.%s" % model_name,
+                    "model_id": ir_model.id,
+                    "domain_force": get_security_rule_domain(model),
+                }
+            )
+            model.create(
+                [
+                    {"name": "record %s" % i, "company_ids": [(6, 0, company_ids)]}
+                    for i, company_ids in enumerate(company_ids_list)
+                ]
+            )
+            cls.models.append(model_name)
+        cls.env["base"].flush()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.loader.restore_registry()
+        super().tearDownClass()
+
+    def _get_operations(self, model):
+        # Domains rewritten by _patch_company_domain, the first one being sent
+        # by the web client for the allowed companies
+        company_domain = [("company_id", "in", self.allowed_company_ids + [False])]
+        not_in_domain = [("company_ids", "not in", self.allowed_company_ids[:1])]
+        return [
+            ("search", lambda: model.search([], limit=80)),
+            ("search_count", lambda: model.search_count([])),
+            ("name_search", lambda: model.name_search("record 1", limit=8)),
+            ("search_read", lambda: model.search_read([], ["name"], limit=80)),
+            (
+                "read_group",
+                lambda: model.read_group([], ["name"], ["no_company_ids"]),
+            ),
+            ("search company", lambda: model.search(company_domain, limit=80)),
+            (
+                "name_search company",
+                lambda: model.name_search("record 1", args=company_domain, limit=8),
+            ),
+            (
+                "search_read company",
+                lambda: model.search_read(company_domain, ["name"], limit=80),
+            ),
+            ("search_count not in", lambda: model.search_count(not_in_domain)),
+        ]
+
+    def _measure(self, func):
+        timings, queries = [], []
+        for _i in range(self.repeat):
+            self.env["base"].invalidate_cache()
+            count = self.env.cr.sql_log_count
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+            queries.append(self.env.cr.sql_log_count - count)
+        return (
+            _percentile(timings, 0.5) * 1000,
+            _percentile(timings, 0.95) * 1000,
+            max(queries),
+        )
+
+    def test_rule_benchmark(self):
+        lines = []
+        for model_name in self.models:
+            model = (
+                self.env[model_name]
+                .with_user(self.user)
+                .with_context(allowed_company_ids=self.allowed_company_ids)
+            )
+            for operation, func in self._get_operations(model):
+                p50, p95, queries = self._measure(func)
+                lines.append(
+                    "%-40s %-20s p50 %8.2fms  p95 %8.2fms  %3s queries"
+                    % (model_name, operation, p50, p95, queries)
+                )
+        _logger.info(
+            "Multi-company record rule benchmark (%s records, %s companies):\n%s",
+            self.env[self.models[0]].search_count([]),
+            len(self.companies),
+            "\n".join(lines),
+        )
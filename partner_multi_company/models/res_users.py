@@ -1,29 +1,44 @@
 # Copyright 2015-2016 Pedro M. Baeza <pedro.baeza@tecnativa.com>
 # License AGPL-3 - See http://www.gnu.org/licenses/agpl-3.0.html.html
 
+from collections import defaultdict
+
 from odoo import api, models
 
 
 class ResUsers(models.Model):
     _inherit = "res.users"
 
-    @api.model
-    def create(self, vals):
-        res = super(ResUsers, self).create(vals)
-        if "company_ids" in vals:
-            res.partner_id.company_ids = vals["company_ids"]
-        if "company_id" in vals and res.partner_id.company_ids:
-            res.partner_id.company_id = vals["company_id"]
-        return res
+    @api.model_create_multi
+    def create(self, vals_list):
+        users = super(ResUsers, self).create(vals_list)
+        # Group the partners by the values to propagate, for writing them once
+        # per distinct value instead of once per user
+        company_ids_groups = []
+        company_id_groups = defaultdict(lambda: self.env["res.partner"])
+        for user, vals in zip(users, vals_list):
+            if "company_ids" in vals:
+                for group in company_ids_groups:
+                    if group[0] == vals["company_ids"]:
+                        group[1] |= user.partner_id
+                        break
+                else:
+                    company_ids_groups.append([vals["company_ids"], user.partner_id])
+        for company_ids, partners in company_ids_groups:
+            partners.company_ids = company_ids
+        for user, vals in zip(users, vals_list):
+            if "company_id" in vals and user.partner_id.company_ids:
+                company_id_groups[vals["company_id"]] |= user.partner_id
+        for company_id, partners in company_id_groups.items():
+            partners.company_id = company_id
+        return users
 
     def write(self, vals):
         res = super(ResUsers, self).write(vals)
-        if "company_ids" in vals:
-            for user in self.sudo():
-                if user.partner_id.company_ids:
-                    user.partner_id.company_ids = vals["company_ids"]
-        if "company_id" in vals:
-            for user in self.sudo():
-                if user.partner_id.company_ids:
-                    user.partner_id.company_ids = [(4, vals["company_id"])]
+        if "company_ids" in vals or "company_id" in vals:
+            partners = self.sudo().mapped("partner_id").filtered("company_ids")
+            if "company_ids" in vals:
+                partners.company_ids = vals["company_ids"]
+            if "company_id" in vals:
+                partners.filtered("company_ids").company_ids = [(4, vals["company_id"])]
         return res
@@ -167,3 +167,32 @@ class TestPartnerMultiCompany(common.TransactionCase):
         user_partner.write({"company_id": False, "company_ids": [(5, False)]})
         self.user_company_1.write({"company_id": self.company_2.id})
         self.assertEqual(user_partner.company_ids.ids, [])
+
+    def test_create_multi(self):
+        partners = self.partner_model.create(
+            [
+                {"name": "Batch 1", "company_ids": [(6, 0, self.company_1.ids)]},
+                {"name": "Batch 2", "company_ids": [(4, self.company_2.id)]},
+                {"name": "Batch 3", "company_ids": False},
+            ]
+        )
+        self.assertEqual(partners[0].company_ids, self.company_1)
+        self.assertEqual(partners[1].company_ids, self.company_2)
+        self.assertFalse(partners[2].company_ids)
+        companies = self.company_1 + self.company_2
+        users = self.env["res.users"].create(
+            [
+                {
+                    "name": "Batch user %s" % i,
+                    "login": "batch_user_%s" % i,
+                    "company_id": self.company_1.id,
+                    "company_ids": [(6, 0, companies.ids)],
+                }
+                for i in range(3)
+            ]
+        )
+        for user in users:
+            self.assertEqual(user.partner_id.company_ids, self.company_1)
+        users.write({"company_ids": [(6, 0, companies.ids)]})
+        for user in users:
+            self.assertEqual(user.partner_id.company_ids, companies)
@@ -9,11 +9,12 @@ from odoo import _, models
 class AccountMove(models.Model):
     _inherit = "account.move"
 
-    def _inter_company_create_invoice(self, dest_company):
-        res = super()._inter_company_create_invoice(dest_company)
-        if res["dest_invoice"].move_type == "in_invoice":
-            self._link_invoice_purchase(res["dest_invoice"])
-        return res
+    def _inter_company_create_invoices(self, dest_company):
+        dest_invoices = super()._inter_company_create_invoices(dest_company)
+        for src_invoice, dest_invoice in zip(self, dest_invoices):
+            if dest_invoice.move_type == "in_invoice":
+                src_invoice._link_invoice_purchase(dest_invoice)
+        return dest_invoices
 
     def _link_invoice_purchase(self, dest_invoice):
         self.ensure_one()
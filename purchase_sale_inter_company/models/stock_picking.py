@@ -65,11 +65,9 @@ class StockPicking(models.Model):
     def button_validate(self):
         res = super().button_validate()
         company_obj_sudo = self.env["res.company"].sudo()
-        is_intercompany = company_obj_sudo.search(
-            [("partner_id", "=", self.partner_id.id)]
-        ) or company_obj_sudo.search(
-            [("partner_id", "=", self.partner_id.parent_id.id)]
-        )
+        is_intercompany = company_obj_sudo._find_company_from_partner(
+            self.partner_id
+        ) or company_obj_sudo._find_company_from_partner(self.partner_id.parent_id)
         if (
             is_intercompany
             and self.company_id.sync_picking
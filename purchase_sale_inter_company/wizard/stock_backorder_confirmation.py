@@ -22,11 +22,13 @@ class StockBackorderConfirmation(models.TransientModel):
             )
         if not picking or not sale_order:
             return res
-        is_intercompany = self.env["res.company"].search(
-            [("partner_id", "=", picking.partner_id.id)]
-        ) or self.env["res.company"].search(
-            [("partner_id", "=", picking.partner_id.parent_id.id)]
-        )
+        # As in StockPicking.button_validate: the destination company is
+        # usually not readable by the user receiving the goods, while its
+        # sync_picking setting is read below
+        company_obj = self.env["res.company"].sudo()
+        is_intercompany = company_obj._find_company_from_partner(
+            picking.partner_id
+        ) or company_obj._find_company_from_partner(picking.partner_id.parent_id)
         if (
             is_intercompany
             and is_intercompany.sync_picking
@@ -0,0 +1 @@
+from . import res_company
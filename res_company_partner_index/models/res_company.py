@@ -0,0 +1,53 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo import api, models, tools
+
+
+class ResCompany(models.Model):
+    _inherit = "res.company"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        companies = super().create(vals_list)
+        self.clear_caches()
+        return companies
+
+    def write(self, vals):
+        res = super().write(vals)
+        if "partner_id" in vals or "active" in vals:
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
+
+    @api.model
+    @tools.ormcache()
+    def _get_company_ids_by_partner(self):
+        """Index of the active companies by partner, shared by the whole
+        registry and invalidated when the partner of a company changes.
+
+        :return: dict {partner id: tuple of company ids, in company order}
+        """
+        company_ids_by_partner = {}
+        for company in self.sudo().search([]):
+            company_ids_by_partner.setdefault(company.partner_id.id, []).append(
+                company.id
+            )
+        return {
+            partner_id: tuple(company_ids)
+            for partner_id, company_ids in company_ids_by_partner.items()
+        }
+
+    @api.model
+    def _find_company_from_partner(self, partner, exclude_company=None):
+        """Return the company whose partner is `partner`, other than
+        `exclude_company`, or an empty recordset.
+        """
+        company_ids = self._get_company_ids_by_partner().get(partner.id, ())
+        for company_id in company_ids:
+            if not exclude_company or company_id != exclude_company.id:
+                return self.browse(company_id)
+        return self.browse()
@@ -0,0 +1 @@
+from . import test_res_company_partner_index
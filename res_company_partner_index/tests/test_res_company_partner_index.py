@@ -0,0 +1,35 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tests.common import SavepointCase
+
+
+class TestResCompanyPartnerIndex(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company_obj = cls.env["res.company"]
+        cls.company = cls.company_obj.create({"name": "Indexed company"})
+        cls.partner = cls.company.partner_id
+
+    def test_find_company_from_partner(self):
+        self.assertEqual(
+            self.company_obj._find_company_from_partner(self.partner), self.company
+        )
+        self.assertFalse(
+            self.company_obj._find_company_from_partner(
+                self.partner, exclude_company=self.company
+            )
+        )
+        self.assertFalse(
+            self.company_obj._find_company_from_partner(self.env["res.partner"])
+        )
+
+    def test_index_invalidation(self):
+        new_partner = self.env["res.partner"].create({"name": "New partner"})
+        self.company.partner_id = new_partner
+        self.assertFalse(self.company_obj._find_company_from_partner(self.partner))
+        self.assertEqual(
+            self.company_obj._find_company_from_partner(new_partner), self.company
+        )
+        self.company.active = False
+        self.assertFalse(self.company_obj._find_company_from_partner(new_partner))
@@ -11,6 +11,7 @@ setuptools.setup(
         'odoo14-addon-account_invoice_consolidated',
         'odoo14-addon-account_invoice_inter_company',
         'odoo14-addon-account_invoice_inter_company_queued',
+        'odoo14-addon-account_invoice_inter_company_related_bill_stored',
         'odoo14-addon-account_invoice_inter_company_sale',
         'odoo14-addon-account_move_change_company',
         'odoo14-addon-account_multicompany_easy_creation',
@@ -33,6 +34,7 @@ setuptools.setup(
         'odoo14-addon-purchase_quick_intercompany',
         'odoo14-addon-purchase_sale_inter_company',
         'odoo14-addon-res_company_code',
+        'odoo14-addon-res_company_partner_index',
         'odoo14-addon-stock_intercompany',
     ],
     classifiers=[
@@ -8,7 +8,7 @@
     "author": "Camptocamp, Odoo Community Association (OCA)",
     "website": "https://github.com/OCA/multi-company",
     "category": "Warehouse Management",
-    "depends": ["stock"],
+    "depends": ["stock", "res_company_partner_index"],
     "installable": True,
     "license": "AGPL-3",
     "data": [
@@ -5,10 +5,10 @@ class StockPicking(models.Model):
     _inherit = "stock.picking"
 
     def _create_counterpart_picking(self):
-        companies = self.env["res.company"].sudo().search([])
-        partners = {cp.partner_id: cp for cp in companies}
-        if self.partner_id in partners:
-            company = partners[self.partner_id]
+        company = (
+            self.env["res.company"].sudo()._find_company_from_partner(self.partner_id)
+        )
+        if company:
             warehouse = False
             if company.intercompany_in_type_id.warehouse_id:
                 warehouse = company.intercompany_in_type_id.warehouse_id